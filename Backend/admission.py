@@ -0,0 +1,209 @@
+"""Admission control: turn requests away before they overload the worker.
+
+Checked in order when a request to a limited endpoint arrives:
+
+    413  Content-Length over the endpoint's upload cap; a body without a
+         declared length is cut off (the app sees a client disconnect) once
+         it passes the cap, and still answered with 413
+    429  the endpoint already has its concurrency limit of requests running
+    503  the in-flight byte budget (ADMISSION_MAX_INFLIGHT_BYTES) is used up
+
+429 and 503 carry Retry-After. Rejections are immediate rather than
+queued, so a saturated worker sheds load instead of piling up latency.
+
+The byte budget stands for request bodies held in memory, so only the
+whole-body routes (text, raw and batch) are charged, from the moment they
+are admitted until the response is done: the declared Content-Length is
+reserved up front, and bodies without one are charged as they arrive.
+One request is always let in while no other body is charged, so a single
+body larger than the budget can still succeed. /encrypt-file,
+/decrypt-file and /jobs stream in fixed-size chunks (STREAMING_ENDPOINTS);
+they are never charged and never turned away with 503.
+
+The upload cap is ADMISSION_MAX_UPLOAD_BYTES on whole-body routes and off
+on streaming ones, so multi-GB files go through; override per endpoint
+with ADMISSION_UPLOAD_LIMITS="/encrypt-file=10000000000" (0 is no cap).
+
+Limits are per endpoint path (DEFAULT_LIMITS, overridden by
+ADMISSION_LIMITS="/encrypt-file=4,/jobs=8"); /jobs covers every
+/jobs/... path. Unlisted paths such as /ready, /metrics and /audit are
+never limited. ADMISSION_ENABLED=0 switches all of it off.
+"""
+import os
+
+from starlette.responses import JSONResponse
+
+from metrics import Counter, Gauge
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_INFLIGHT_BYTES = int(os.environ.get("ADMISSION_MAX_INFLIGHT_BYTES", 512 * 1024 * 1024))
+# Upload cap of the whole-body routes; 0 disables it
+ADMISSION_MAX_UPLOAD_BYTES = int(os.environ.get("ADMISSION_MAX_UPLOAD_BYTES", 1024 * 1024 * 1024))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+
+# Concurrent requests per endpoint; whole-body routes get less room than streaming ones
+DEFAULT_LIMITS = {
+    "/encrypt-text": 256, "/decrypt-text": 256,
+    "/encrypt-text/raw": 64, "/decrypt-text/raw": 64,
+    "/encrypt-text/batch": 16, "/decrypt-text/batch": 16,
+    "/encrypt-file": 32, "/decrypt-file": 32,
+    "/jobs": 64,
+}
+
+# Bodies go through in fixed-size chunks, so their length costs no memory
+STREAMING_ENDPOINTS = frozenset({"/encrypt-file", "/decrypt-file", "/jobs"})
+
+REJECTED = Counter("hashbytes_admission_rejected_total", "Requests turned away by admission control", ("endpoint", "status"))
+
+
+def parse_limits(text: str, name: str = "ADMISSION_LIMITS") -> dict[str, int]:
+    """"/encrypt-file=4,/jobs=8" -> {"/encrypt-file": 4, "/jobs": 8}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        path, _, value = item.partition("=")
+        if not path.startswith("/") or not value.isdigit():
+            raise ValueError(f"Bad {name} entry: {item}")
+        limits[path] = int(value)
+    return limits
+
+
+class Admission:
+    """In-flight counters shared by every AdmissionMiddleware of the process.
+
+    Only touched from the event loop, so plain integers need no lock.
+    """
+
+    def __init__(self, limits: dict[str, int] | None = None, max_inflight_bytes: int = ADMISSION_MAX_INFLIGHT_BYTES,
+                 max_upload_bytes: int = ADMISSION_MAX_UPLOAD_BYTES, retry_after: int = ADMISSION_RETRY_AFTER,
+                 upload_limits: dict[str, int] | None = None, streaming=STREAMING_ENDPOINTS):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_upload_bytes = max_upload_bytes
+        self.upload_limits = dict(upload_limits or {})
+        self.streaming = frozenset(streaming)
+        self.retry_after = retry_after
+        self.running: dict[str, int] = {}
+        self.inflight_bytes = 0
+
+    @property
+    def inflight_requests(self) -> int:
+        return sum(self.running.values())
+
+    def endpoint(self, path: str) -> str | None:
+        """The limits key covering path: the path itself or its nearest listed parent."""
+        while path:
+            if path in self.limits:
+                return path
+            path = path.rpartition("/")[0]
+        return None
+
+    def charged(self, endpoint: str) -> bool:
+        """Whether the endpoint's bodies count against the in-flight byte budget."""
+        return endpoint not in self.streaming
+
+    def upload_limit(self, endpoint: str) -> int:
+        """Largest body accepted on endpoint; 0 is no cap."""
+        if endpoint in self.upload_limits:
+            return self.upload_limits[endpoint]
+        return 0 if endpoint in self.streaming else self.max_upload_bytes
+
+    def check(self, endpoint: str, declared: int | None) -> tuple[int, str] | None:
+        """(status, reason) if the request must be rejected, else None."""
+        cap = self.upload_limit(endpoint)
+        if declared is not None and cap and declared > cap:
+            return 413, f"Upload larger than {cap} bytes"
+        if self.running.get(endpoint, 0) >= self.limits[endpoint]:
+            return 429, f"Too many concurrent {endpoint} requests"
+        if (self.charged(endpoint) and self.inflight_bytes
+                and self.inflight_bytes + (declared or 0) > self.max_inflight_bytes):
+            return 503, "Server is at its in-flight byte budget"
+        return None
+
+
+def _env_limits(name: str) -> dict[str, int] | None:
+    return parse_limits(os.environ[name], name) if os.environ.get(name) else None
+
+
+admission = Admission(_env_limits("ADMISSION_LIMITS"), upload_limits=_env_limits("ADMISSION_UPLOAD_LIMITS"))
+
+Gauge("hashbytes_admission_inflight_requests", "Admitted requests still running", lambda: admission.inflight_requests)
+Gauge("hashbytes_admission_inflight_bytes", "Request body bytes charged to the in-flight budget", lambda: admission.inflight_bytes)
+
+
+def _content_length(scope) -> int | None:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, state: Admission | None = None, enabled: bool = ADMISSION_ENABLED):
+        self.app = app
+        self.state = state or admission
+        self.enabled = enabled
+
+    async def _reject(self, scope, receive, send, endpoint: str, status: int, reason: str):
+        REJECTED.inc(endpoint=endpoint, status=str(status))
+        headers = {"Retry-After": str(self.state.retry_after)} if status != 413 else {}
+        await JSONResponse({"detail": reason}, status_code=status, headers=headers)(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = self.state
+        endpoint = state.endpoint(scope["path"])
+        if endpoint is None:
+            return await self.app(scope, receive, send)
+        declared = _content_length(scope)
+        rejection = state.check(endpoint, declared)
+        if rejection:
+            return await self._reject(scope, receive, send, endpoint, *rejection)
+
+        counts = state.charged(endpoint)
+        cap = state.upload_limit(endpoint)
+        charged = (declared or 0) if counts else 0
+        received = 0
+        too_large = False
+        started = False
+        state.running[endpoint] = state.running.get(endpoint, 0) + 1
+        state.inflight_bytes += charged
+
+        async def counted_receive():
+            nonlocal charged, received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if counts and received > charged:
+                    state.inflight_bytes += received - charged
+                    charged = received
+                if cap and received > cap:
+                    # Look like a dropped client so the handler stops reading
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if too_large and not started:
+                # The 413 below replaces whatever the handler answers
+                return
+            started = True
+            await send(message)
+
+        try:
+            try:
+                await self.app(scope, counted_receive, guarded_send)
+            except Exception:
+                if not too_large or started:
+                    raise
+            if too_large and not started:
+                await self._reject(scope, receive, send, endpoint, 413, f"Upload larger than {cap} bytes")
+        finally:
+            state.running[endpoint] -= 1
+            state.inflight_bytes -= charged
@@ -0,0 +1,306 @@
+"""Audit log persistence and queries.
+
+Handlers hand rows to `audit_log` and return straight away; a background
+task drains the queue and writes whole batches in one transaction through
+the configured storage backend (see storage.py), so no request waits on a
+disk sync. Each batch also bumps the hourly counters in `operation_stats`,
+which is what /audit/stats reads.
+"""
+import asyncio
+import base64
+import importlib
+import os
+import traceback
+import weakref
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+import storage
+from definitions import BASE, HourlyStats, Table
+from logic import metric_labels
+from metrics import Gauge, stage
+
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 0.05))
+# "block" makes requests wait for room in a full queue, "drop" discards the row
+AUDIT_OVERFLOW = os.environ.get("AUDIT_OVERFLOW", "block")
+
+
+class AuditWriter:
+    def __init__(self, storage: storage.Storage, max_size: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, overflow: str = AUDIT_OVERFLOW):
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"Unknown audit overflow policy: {overflow}")
+        self.storage = storage
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self.written = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def record(self, **fields):
+        """Queue one operations row; performed_at is stamped now, not at flush time."""
+        with stage("audit", *metric_labels(fields.get("algorithm"), fields.get("mode"))):
+            await self.record_many([fields])
+
+    async def record_many(self, rows: list[dict]):
+        self.start()
+        for row in rows:
+            row.setdefault("performed_at", datetime.now())
+            if self.overflow == "block":
+                await self._queue.put(row)
+                continue
+            try:
+                self._queue.put_nowait(row)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            # Give concurrent requests a moment to pile onto this batch
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    batch.append(self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+            if None in batch:
+                stopping = True
+                batch = [row for row in batch if row is not None]
+                while not self._queue.empty():
+                    row = self._queue.get_nowait()
+                    if row is not None:
+                        batch.append(row)
+            if batch:
+                await self._write(batch)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _write(self, rows: list[dict]):
+        try:
+            await setup(self.storage)
+            with stage("audit_flush"):
+                await self.storage.run(_flush, rows)
+            self.written += len(rows)
+        except Exception:
+            print(f"Audit flush failed, {len(rows)} rows lost:")
+            traceback.print_exc()
+
+
+def _flush(db, rows: list[dict]):
+    db.execute(insert(Table), rows)
+    # The counters can be rebuilt from operations; the rows can't be rebuilt from anything
+    try:
+        with db.begin_nested():
+            add_stats(db, rows)
+    except SQLAlchemyError:
+        print(f"Audit stats update failed, {len(rows)} rows kept; rebuild_stats() recounts them:")
+        traceback.print_exc()
+    db.commit()
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def _bump(db, hour, operation, algorithm, mode, count) -> bool:
+    updated = db.execute(
+        update(HourlyStats)
+        .where(HourlyStats.hour == hour, HourlyStats.operation == operation,
+               HourlyStats.algorithm == algorithm, HourlyStats.mode == mode)
+        .values(count=HourlyStats.count + count)
+    )
+    return bool(updated.rowcount)
+
+
+def add_stats(db, rows):
+    """Add rows to the hourly counters inside the caller's transaction.
+
+    Several workers may flush into the same new hour at once, so the
+    counters are upserted: one ON CONFLICT statement where the dialect has
+    it, elsewhere update-then-insert with the insert retried as an update
+    if another worker got there first.
+    """
+    counts = Counter(
+        (hour_of(row["performed_at"]), row["operation"], row["algorithm"], row["mode"])
+        for row in rows
+    )
+    dialect = db.get_bind().dialect.name
+    if dialect in UPSERT_DIALECTS:
+        values = [
+            dict(hour=hour, operation=operation, algorithm=algorithm, mode=mode, count=count)
+            for (hour, operation, algorithm, mode), count in counts.items()
+        ]
+        dialect_insert = importlib.import_module(f"sqlalchemy.dialects.{dialect}").insert
+        # Stays under old SQLite's 999 bound parameters per statement
+        for start in range(0, len(values), 150):
+            statement = dialect_insert(HourlyStats).values(values[start:start + 150])
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[HourlyStats.hour, HourlyStats.operation, HourlyStats.algorithm, HourlyStats.mode],
+                set_={"count": HourlyStats.count + statement.excluded.count},
+            ))
+        return
+    for (hour, operation, algorithm, mode), count in counts.items():
+        if _bump(db, hour, operation, algorithm, mode, count):
+            continue
+        try:
+            with db.begin_nested():
+                db.add(HourlyStats(hour=hour, operation=operation, algorithm=algorithm, mode=mode, count=count))
+        except IntegrityError:
+            _bump(db, hour, operation, algorithm, mode, count)
+
+
+def rebuild_stats(db, since: datetime | None = None, batch_size: int = 10000):
+    """Recompute operation_stats from the operations table, for the hours from since on.
+
+    Rows moved to the archive by retention are no longer in the table, so
+    pass a since after the archived range to keep those hours' counts.
+    """
+    since = since and hour_of(since)
+    stale = db.query(HourlyStats)
+    query = select(Table.performed_at, Table.operation, Table.algorithm, Table.mode)
+    if since:
+        stale = stale.filter(HourlyStats.hour >= since)
+        query = query.where(Table.performed_at >= since)
+    stale.delete()
+    rows = db.execute(query.execution_options(yield_per=batch_size)).mappings()
+    for part in rows.partitions():
+        add_stats(db, [dict(row) for row in part])
+        db.flush()
+    db.commit()
+
+
+def encode_cursor(row) -> str:
+    return base64.urlsafe_b64encode(f"{row.performed_at.isoformat()}|{row.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        moment, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(moment), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def naive_local(value: datetime | None) -> datetime | None:
+    """performed_at is naive local time; express a timezone-aware bound the same way."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def _filters(model, operation, algorithm, mode, since, until, column):
+    conditions = []
+    if operation:
+        conditions.append(model.operation == operation)
+    if algorithm:
+        conditions.append(model.algorithm == algorithm)
+    if mode:
+        conditions.append(model.mode == mode)
+    if since:
+        conditions.append(column >= since)
+    if until:
+        conditions.append(column < until)
+    return conditions
+
+
+def query_operations(db, operation=None, algorithm=None, mode=None, since=None, until=None,
+                     cursor=None, limit: int = 100) -> tuple[list[dict], str | None]:
+    """One page of operations, newest first, and the cursor for the next page.
+
+    Keys are never returned. The cursor is the (performed_at, id) of the
+    last row, so each page is a single index range scan however deep it is.
+    """
+    conditions = _filters(Table, operation, algorithm, mode, since, until, Table.performed_at)
+    if cursor:
+        moment, row_id = decode_cursor(cursor)
+        conditions.append(or_(Table.performed_at < moment, and_(Table.performed_at == moment, Table.id < row_id)))
+    rows = db.execute(
+        select(Table.id, Table.operation, Table.algorithm, Table.mode, Table.file_extension, Table.performed_at)
+        .where(*conditions)
+        .order_by(Table.performed_at.desc(), Table.id.desc())
+        .limit(limit + 1)
+    ).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [dict(row._mapping) for row in rows[:limit]], next_cursor
+
+
+def query_stats(db, operation=None, algorithm=None, mode=None, since=None, until=None) -> list[dict]:
+    """Hourly operation counts for the hours starting in [since rounded down, until)."""
+    conditions = _filters(HourlyStats, operation, algorithm, mode, since and hour_of(since), until, HourlyStats.hour)
+    rows = db.execute(
+        select(HourlyStats.hour, HourlyStats.operation, HourlyStats.algorithm, HourlyStats.mode, HourlyStats.count)
+        .where(*conditions)
+        .order_by(HourlyStats.hour, HourlyStats.operation, HourlyStats.algorithm, HourlyStats.mode)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+
+def create_schema(conn):
+    BASE.metadata.create_all(conn)
+    # create_all skips tables that already exist, so add indexes new since then
+    for index in Table.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _backfill_stats(db):
+    # One-off for databases that predate operation_stats
+    if db.query(HourlyStats).first() is None and db.query(Table.id).first() is not None:
+        rebuild_stats(db)
+
+
+_prepared = weakref.WeakSet()
+# asyncio locks belong to one loop; tests and scripts may run several
+_setup_locks = weakref.WeakKeyDictionary()
+
+
+async def setup(store: storage.Storage | None = None):
+    """Create missing tables and indexes and backfill stats, once per backend.
+
+    Call it before anything that needs the schema: the first caller does
+    the work (or the startup warmup already has), later calls return at once.
+    """
+    store = store or audit_log.storage
+    if store in _prepared:
+        return
+    loop = asyncio.get_running_loop()
+    async with _setup_locks.setdefault(loop, asyncio.Lock()):
+        if store not in _prepared:
+            await store.setup(create_schema)
+            await store.run(_backfill_stats)
+            _prepared.add(store)
+
+
+audit_log = AuditWriter(storage.from_env())
+
+Gauge("hashbytes_audit_queue_depth", "Audit rows waiting to be written", audit_log.queued)
+Gauge("hashbytes_audit_rows_written", "Audit rows written since start", lambda: audit_log.written)
+Gauge("hashbytes_audit_rows_dropped", "Audit rows dropped on a full queue", lambda: audit_log.dropped)
@@ -0,0 +1,95 @@
+"""Cold import time of the app, checked against a budget.
+
+Run from Backend/:
+
+    python -m benchmarks.importtime --runs 7 --budget-ms 1000
+
+Each run imports `main` in a fresh interpreter under `python -X importtime`
+and reads the cumulative time of the top-level import. The median is
+compared with --budget-ms, and the modules with the largest self time are
+listed. It also fails if any module in DEFERRED was imported: those load on
+first use or during the startup warmup, never at import. Exit status is 1
+on either failure.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 1000))
+
+# Must not be imported by `import main`; see logic.CIPHER_MODULES and main.get_templates
+DEFERRED = (
+    "Crypto.Cipher.AES", "Crypto.Cipher.DES", "Crypto.Cipher.DES3", "Crypto.Cipher.CAST",
+    "Crypto.Cipher.ChaCha20_Poly1305", "jinja2",
+)
+
+
+def parse(stderr: str) -> dict[str, tuple[int, int]]:
+    """module -> (self us, cumulative us) from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure(module: str = "main") -> dict[str, tuple[int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    return parse(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="modules to list by self time")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [run[args.module][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+    last = runs[-1]
+
+    print(f"{'module':<48}{'self ms':>10}{'cumul ms':>10}")
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"{name:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>10.1f}")
+    # A package's first import includes its submodules, so the max is its cost
+    packages = {}
+    for name, (_, cumulative_us) in last.items():
+        if name != args.module:
+            root = name.split(".")[0]
+            packages[root] = max(packages.get(root, 0), cumulative_us)
+    print("\nlargest packages (cumulative ms): " + ", ".join(
+        f"{name} {us / 1000:.0f}" for name, us in sorted(packages.items(), key=lambda item: -item[1])[:6]))
+    print(f"import {args.module}: median {median:.0f} ms over {args.runs} runs "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}), budget {args.budget_ms:.0f} ms")
+
+    eager = [name for name in DEFERRED if name in last]
+    failed = False
+    if eager:
+        print(f"FAIL imported at startup but should be deferred: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL over budget by {median - args.budget_ms:.0f} ms")
+        failed = True
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"module": args.module, "median_ms": median, "runs_ms": totals,
+                       "budget_ms": args.budget_ms, "eager": eager}, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
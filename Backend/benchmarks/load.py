@@ -0,0 +1,259 @@
+"""Closed-loop load generator for the four main endpoints.
+
+Run from Backend/:
+
+    python -m benchmarks.load --concurrency 1,4,16,64 --duration 10
+    python -m benchmarks.load --spawn --sizes 1K:8,64K:3,4M:1 --algorithms AES/GCM,DES3/CBC
+    python -m benchmarks.load --url http://127.0.0.1:8000 --pid 12345
+
+For each concurrency level, that many clients send requests back to back
+for --duration seconds. Each request picks an endpoint (--mix), a payload
+size (--sizes, size:weight) and an algorithm/mode pair at random. The
+table shows requests/s, MB/s, p50/p99 latency, rejections (413/429/503 from
+admission control), errors and peak RSS of the server process. The knee is
+where requests/s stops rising while p99 keeps growing.
+
+By default the app runs in-process through httpx's ASGI transport, so RSS
+is this process. --spawn starts `uvicorn main:create_app --factory` on a
+free port instead, and --url targets a server that is already running
+(give --pid for its RSS). Audit rows go to an in-memory database in the
+in-process and --spawn modes. Needs httpx, which the FastAPI test client
+uses as well.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import string
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.suite import format_size, parse_size
+
+ENDPOINTS = ("encrypt-text", "decrypt-text", "encrypt-file", "decrypt-file")
+
+
+def parse_weights(text: str, key=str) -> list[tuple]:
+    """"1K:8,1M:1" -> [(key("1K"), 8), (key("1M"), 1)]; the weight defaults to 1."""
+    items = []
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = part.partition(":")
+        items.append((key(name), float(weight or 1)))
+    return items
+
+
+def rss_bytes(pid: int | None) -> int | None:
+    """Resident set size of pid (this process when None); None if it cannot be read."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        # Peak rather than current outside Linux; ru_maxrss is bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class Fixtures:
+    """Plaintexts plus matching ciphertexts and keys, made once through the API."""
+
+    def __init__(self, sizes, pairs):
+        self.sizes, self.pairs = sizes, pairs
+        self.texts, self.blobs = {}, {}
+        self.text_ciphers, self.file_ciphers = {}, {}
+
+    async def prepare(self, client: httpx.AsyncClient):
+        for size in self.sizes:
+            self.texts[size] = "".join(random.choices(string.ascii_letters, k=size))
+            self.blobs[size] = os.urandom(size)
+            for algorithm, mode in self.pairs:
+                params = {"algorithm": algorithm, "mode": mode}
+                response = await client.post("/encrypt-text", json={"text": self.texts[size], **params})
+                response.raise_for_status()
+                self.text_ciphers[size, algorithm, mode] = response.json()
+                response = await client.post("/encrypt-file", data=params, files={"file": ("load.bin", self.blobs[size])})
+                response.raise_for_status()
+                self.file_ciphers[size, algorithm, mode] = (response.content, response.headers["key"])
+
+    def request(self, client: httpx.AsyncClient, endpoint: str, size: int, algorithm: str, mode: str):
+        params = {"algorithm": algorithm, "mode": mode}
+        if endpoint == "encrypt-text":
+            return client.post("/encrypt-text", json={"text": self.texts[size], **params})
+        if endpoint == "decrypt-text":
+            encrypted = self.text_ciphers[size, algorithm, mode]
+            return client.post("/decrypt-text", json={"cipher": encrypted["cipher"], "key": encrypted["key"], **params})
+        if endpoint == "encrypt-file":
+            return client.post("/encrypt-file", data=params, files={"file": ("load.bin", self.blobs[size])})
+        ciphertext, key = self.file_ciphers[size, algorithm, mode]
+        return client.post("/decrypt-file", data={"key": key, **params}, files={"file": ("load.bin.enc", ciphertext)})
+
+
+async def run_level(client, fixtures, args, concurrency: int) -> dict:
+    rng = random.Random(args.seed + concurrency)
+    endpoints, endpoint_weights = zip(*args.mix)
+    sizes, size_weights = zip(*args.sizes)
+    latencies, statuses = [], {}
+    payload = 0
+    peak_rss = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        nonlocal payload
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, endpoint_weights)[0]
+            size = rng.choices(sizes, size_weights)[0]
+            algorithm, mode = rng.choice(args.algorithms)
+            start = time.perf_counter()
+            try:
+                response = await fixtures.request(client, endpoint, size, algorithm, mode)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = "error"
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                payload += size
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, rss_bytes(args.pid) or 0)
+            await asyncio.sleep(0.1)
+
+    # Without --pid a remote server's memory is unknown; don't report our own
+    sampler = asyncio.create_task(sample_rss()) if not args.url or args.pid else None
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "req_s": len(latencies) / elapsed,
+        "mb_s": payload / elapsed / 1e6,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else None,
+        "rejected": statuses.get(429, 0) + statuses.get(503, 0) + statuses.get(413, 0),
+        "errors": sum(count for status, count in statuses.items() if status not in (200, 413, 429, 503)),
+        "peak_rss_mb": peak_rss / 1e6 if sampler else None,
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not become ready")
+
+
+async def run(args) -> list[dict]:
+    server = None
+    lifespan = None
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 8)
+    if args.url or args.spawn:
+        url = args.url
+        if args.spawn:
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:create_app", "--factory", "--port", str(port), "--log-level", "warning"],
+                env={**os.environ, "AUDIT_BACKEND": "memory"},
+            )
+            args.pid = server.pid
+        client = httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits)
+    else:
+        import audit
+        import main
+        from storage import MemoryStorage
+
+        # Keep load-test rows out of audit.db
+        audit.audit_log.storage = MemoryStorage()
+        app = main.create_app()
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=args.timeout)
+
+    try:
+        await _wait_ready(client)
+        fixtures = Fixtures([size for size, _ in args.sizes], args.algorithms)
+        await fixtures.prepare(client)
+        print(f"{'clients':>8}{'req/s':>10}{'MB/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'rejected':>10}{'errors':>8}{'RSS MB':>9}")
+        results = []
+        for concurrency in args.concurrency:
+            result = await run_level(client, fixtures, args, concurrency)
+            results.append(result)
+            p50 = f"{result['p50_ms']:.1f}" if result["p50_ms"] is not None else "-"
+            p99 = f"{result['p99_ms']:.1f}" if result["p99_ms"] is not None else "-"
+            rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "-"
+            print(f"{concurrency:>8}{result['req_s']:>10.1f}{result['mb_s']:>10.2f}{p50:>10}{p99:>10}"
+                  f"{result['rejected']:>10}{result['errors']:>8}{rss:>9}")
+        best = max(results, key=lambda result: result["req_s"])
+        print(f"peak throughput {best['req_s']:.1f} req/s at {best['concurrency']} clients")
+        return results
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma separated client counts, one level each")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per level")
+    parser.add_argument("--sizes", default="1K:8,64K:3,1M:1", help="payload size:weight pairs")
+    parser.add_argument("--algorithms", default="AES/GCM,AES/CBC,ChaCha20/ChaCha20_Poly1305", help="algorithm/mode pairs")
+    parser.add_argument("--mix", default=",".join(ENDPOINTS), help="endpoint:weight pairs from " + ", ".join(ENDPOINTS))
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--pid", type=int, help="server process to sample RSS from (with --url)")
+    parser.add_argument("--spawn", action="store_true", help="start a local uvicorn to test against")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    args.sizes = parse_weights(args.sizes, parse_size)
+    args.algorithms = [tuple(pair.split("/", 1)) for pair in args.algorithms.split(",")]
+    args.mix = parse_weights(args.mix)
+    unknown = [name for name, _ in args.mix if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints in --mix: {', '.join(unknown)}")
+    print(f"sizes {', '.join(format_size(size) for size, _ in args.sizes)}; "
+          f"pairs {', '.join('/'.join(pair) for pair in args.algorithms)}; {args.duration:g}s per level")
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {"sizes": args.sizes, "mix": args.mix, "duration": args.duration}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Throughput of the parallel crypto executor as the pool grows.
+
+Run from Backend/:
+
+    python -m benchmarks.parallel --size-mb 256
+"""
+import argparse
+import os
+import time
+
+import executor
+from logic import encrypt_bytes
+from executor import (
+    run_parallel, split_container_decrypt, split_container_encrypt, split_decrypt, split_encrypt,
+)
+
+
+def _cases(data: bytes):
+    ecb, ecb_key, _, _ = run_parallel(split_encrypt(data, "AES", "ECB"))
+    cbc, cbc_key, _, _ = encrypt_bytes(data, "AES", "CBC")
+    gcm, gcm_key, _, _ = run_parallel(split_container_encrypt(data, "AES", "GCM"))
+    return {
+        "AES-CTR encrypt": lambda: split_encrypt(data, "AES", "CTR"),
+        "AES-ECB decrypt": lambda: split_decrypt(ecb, ecb_key, "AES", "ECB"),
+        "AES-CBC decrypt": lambda: split_decrypt(cbc, cbc_key, "AES", "CBC"),
+        "AES-GCM container encrypt": lambda: split_container_encrypt(data, "AES", "GCM"),
+        "AES-GCM container decrypt": lambda: split_container_decrypt(gcm, gcm_key),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    workers = [1]
+    while workers[-1] * 2 <= args.max_workers:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != args.max_workers:
+        workers.append(args.max_workers)
+
+    cases = _cases(data)
+    print(f"{'case':<28}" + "".join(f"{n:>6} thr" for n in workers) + "   (MB/s)")
+    for name, plan in cases.items():
+        row = []
+        for n in workers:
+            executor.configure(n)
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                run_parallel(plan())
+                best = min(best, time.perf_counter() - start)
+            row.append(args.size_mb / best)
+        print(f"{name:<28}" + "".join(f"{mbps:>10.0f}" for mbps in row))
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
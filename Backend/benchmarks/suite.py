@@ -0,0 +1,159 @@
+"""Throughput/latency benchmark for every algorithm x mode in compatible_map.
+
+Run from Backend/:
+
+    python -m benchmarks.suite --sizes 16,1K,64K,1M --json results.json
+    python -m benchmarks.suite --e2e --baseline results.json --threshold 0.15
+
+Each case reports MB/s, ops/s, p50/p99 latency and peak traced memory. With
+--e2e the same pairs also go through the FastAPI app in-process via the
+/encrypt-text/raw and /decrypt-text/raw routes. With --baseline the exit
+status is 1 when any case lost more than --threshold of its throughput.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from logic import compatible_map, decrypt_bytes, encrypt_bytes
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    unit = text[-1] if text[-1] in UNITS else ""
+    return int(text[:len(text) - len(unit)]) * UNITS[unit]
+
+
+def format_size(size: int) -> str:
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}iB"
+    return f"{size}B"
+
+
+def pairs():
+    for algorithm, modes in compatible_map.items():
+        for mode in modes:
+            yield algorithm, mode
+
+
+def measure(fn, size: int, min_time: float, min_runs: int = 3) -> dict:
+    """Time fn() until min_time has passed, then trace one more call for peak memory."""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_runs or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples.sort()
+    mean = statistics.fmean(samples)
+    return {
+        "runs": len(samples),
+        "mb_s": size / mean / 1e6,
+        "ops_s": 1 / mean,
+        "p50_ms": samples[len(samples) // 2] * 1e3,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e3,
+        "peak_bytes": peak,
+    }
+
+
+def core_cases(sizes, min_time):
+    for size in sizes:
+        data = os.urandom(size)
+        for algorithm, mode in pairs():
+            cipher, key, _, _ = encrypt_bytes(data, algorithm, mode)
+            label = f"{algorithm}/{mode} {format_size(size)}"
+            yield f"core encrypt {label}", measure(lambda: encrypt_bytes(data, algorithm, mode), size, min_time)
+            yield f"core decrypt {label}", measure(lambda: decrypt_bytes(cipher, key, algorithm, mode), size, min_time)
+
+
+def e2e_cases(sizes, min_time):
+    from fastapi.testclient import TestClient
+
+    import audit
+    import main
+    from storage import MemoryStorage
+
+    # Keep benchmark rows out of audit.db
+    audit.audit_log.storage = MemoryStorage()
+
+    with TestClient(main.app) as client:
+        for size in sizes:
+            data = os.urandom(size)
+            for algorithm, mode in pairs():
+                params = {"algorithm": algorithm, "mode": mode}
+                encrypted = client.post("/encrypt-text/raw", params=params, content=data)
+                encrypted.raise_for_status()
+                key = encrypted.headers["key"]
+                label = f"{algorithm}/{mode} {format_size(size)}"
+                yield f"e2e encrypt {label}", measure(
+                    lambda: client.post("/encrypt-text/raw", params=params, content=data).raise_for_status(), size, min_time)
+                yield f"e2e decrypt {label}", measure(
+                    lambda: client.post("/decrypt-text/raw", params=params, content=encrypted.content, headers={"key": key}).raise_for_status(), size, min_time)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Names of cases whose throughput fell by more than threshold."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before and result["mb_s"] < before["mb_s"] * (1 - threshold):
+            regressions.append(f"{name}: {before['mb_s']:.2f} -> {result['mb_s']:.2f} MB/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="16,256,4K,64K,1M", help="comma separated, e.g. 16,1K,1M,1G")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent per case")
+    parser.add_argument("--e2e", action="store_true", help="also benchmark through the FastAPI app")
+    parser.add_argument("--e2e-max-size", default="16M", help="largest payload sent through the app")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed throughput drop, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    cases = core_cases(sizes, args.min_time)
+    results = {}
+    print(f"{'case':<48}{'MB/s':>10}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}")
+    for name, result in cases:
+        results[name] = result
+        print(f"{name:<48}{result['mb_s']:>10.2f}{result['ops_s']:>12.0f}"
+              f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['peak_bytes'] / 1024:>10.0f}")
+    if args.e2e:
+        e2e_sizes = [size for size in sizes if size <= parse_size(args.e2e_max_size)]
+        for name, result in e2e_cases(e2e_sizes, args.min_time):
+            results[name] = result
+            print(f"{name:<48}{result['mb_s']:>10.2f}{result['ops_s']:>12.0f}"
+                  f"{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['peak_bytes'] / 1024:>10.0f}")
+
+    if args.json:
+        meta = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Bounded LRU cache with TTL expiry and hit/miss counters."""
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter, Gauge
+
+CACHE_REQUESTS = Counter("hashbytes_cache_requests_total", "Cache lookups by outcome", ("cache", "result"))
+
+
+class TTLCache:
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name, self.max_size, self.ttl = name, max_size, ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        Gauge(f"hashbytes_cache_{name}_entries", f"Entries in the {name} cache", lambda: len(self._entries))
+
+    def get(self, key):
+        """Cached value or None; expired entries count as misses."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(cache=self.name, result="hit")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
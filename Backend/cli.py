@@ -0,0 +1,193 @@
+"""Encrypt or decrypt local files and whole directory trees, in parallel.
+
+Run from Backend/:
+
+    python -m cli encrypt photos/ vault/ -a AES -m GCM --keys keys.jsonl
+    python -m cli decrypt vault/ restored/ --keys keys.jsonl
+    python -m cli decrypt secret.bin.enc secret.bin --key <hex> -a AES -m CBC
+
+Directories are walked recursively and mirrored under the destination;
+encrypt adds ".enc" to each name and decrypt takes it off again. Every file
+gets its own key, recorded in a manifest that decrypt reads back: one JSON
+line per file (path relative to the destination, key, algorithm, mode),
+appended and fsynced as soon as that file is done, so an interrupted run
+still has the keys of every file it finished. The manifest is created with
+0600 permissions and never overwritten.
+
+Files go through logic.encrypt_path/decrypt_path, so inputs and outputs are
+memory-mapped and never read onto the heap. pycryptodome releases the GIL,
+so a thread per core keeps every core busy.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from logic import decrypt_path, encrypt_path, get_spec
+
+SUFFIX = ".enc"
+
+
+def collect(src: str) -> list[str]:
+    """Relative paths of the files under src; a single file maps to its own name."""
+    if os.path.isfile(src):
+        return [os.path.basename(src)]
+    paths = []
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in sorted(files):
+            paths.append(os.path.relpath(os.path.join(root, name), src))
+    return paths
+
+
+def target_name(relative: str, operation: str) -> str:
+    if operation == "encrypt":
+        return relative + SUFFIX
+    return relative[:-len(SUFFIX)] if relative.endswith(SUFFIX) else relative
+
+
+def _source(src: str, relative: str) -> str:
+    return src if os.path.isfile(src) else os.path.join(src, relative)
+
+
+def _destination(src: str, dst: str, relative: str, operation: str) -> str:
+    # A single source file may be given an explicit output name
+    if os.path.isfile(src) and not os.path.isdir(dst):
+        return dst
+    return os.path.join(dst, target_name(relative, operation))
+
+
+def _manifest_name(src: str, destination: str, relative: str) -> str:
+    """Manifest entries are keyed by the ciphertext path, relative to its tree."""
+    if os.path.isfile(src):
+        return os.path.basename(destination)
+    return target_name(relative, "encrypt")
+
+
+def load_manifest(path: str) -> dict:
+    """path -> {key, algorithm, mode}; a torn last line from an interrupted run is skipped."""
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry.pop("path")] = entry
+    return entries
+
+
+def open_manifest(path: str):
+    """Create the manifest for appending; fails if it already exists."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+    return os.fdopen(fd, "w")
+
+
+def save_entry(manifest, name: str, entry: dict):
+    manifest.write(json.dumps({"path": name, **entry}) + "\n")
+    manifest.flush()
+    os.fsync(manifest.fileno())
+
+
+def encrypt_one(source: str, destination: str, args) -> dict:
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    _, key, algorithm, mode = encrypt_path(
+        source, destination, args.algorithm, args.mode,
+        container=args.container, compression=args.compression, level=args.level,
+    )
+    return {"key": key, "algorithm": algorithm, "mode": mode}
+
+
+def decrypt_one(source: str, destination: str, entry: dict):
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    decrypt_path(source, destination, entry["key"], entry["algorithm"], entry["mode"])
+
+
+def run(args) -> int:
+    """Process every file; returns the number that failed."""
+    if args.operation == "encrypt":
+        get_spec(args.algorithm, args.mode)
+        try:
+            journal = open_manifest(args.keys)
+        except FileExistsError:
+            raise SystemExit(f"{args.keys} already exists; pass another --keys")
+        manifest = None
+    elif args.key:
+        journal = manifest = None
+    else:
+        journal, manifest = None, load_manifest(args.keys)
+
+    keys_path = os.path.abspath(args.keys)
+    started = time.perf_counter()
+    done = failed = total = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {}
+            for relative in collect(args.src):
+                source = _source(args.src, relative)
+                if os.path.abspath(source) == keys_path:
+                    continue
+                destination = _destination(args.src, args.dst, relative, args.operation)
+                if os.path.abspath(source) == os.path.abspath(destination):
+                    print(f"skip {relative}: output would overwrite the input", file=sys.stderr)
+                    failed += 1
+                    continue
+                if args.operation == "encrypt":
+                    future = pool.submit(encrypt_one, source, destination, args)
+                else:
+                    entry = manifest.get(relative) if manifest is not None else \
+                        {"key": args.key, "algorithm": args.algorithm, "mode": args.mode}
+                    if entry is None:
+                        print(f"skip {relative}: no key in {args.keys}", file=sys.stderr)
+                        failed += 1
+                        continue
+                    future = pool.submit(decrypt_one, source, destination, entry)
+                futures[future] = (relative, source, _manifest_name(args.src, destination, relative))
+
+            for future in as_completed(futures):
+                relative, source, name = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    print(f"failed {relative}: {e}", file=sys.stderr)
+                    failed += 1
+                    continue
+                done += 1
+                total += os.path.getsize(source)
+                if entry is not None:
+                    save_entry(journal, name, entry)
+                if args.verbose:
+                    print(f"{args.operation}ed {relative}")
+    finally:
+        if journal is not None:
+            journal.close()
+    elapsed = time.perf_counter() - started
+    print(f"{args.operation}ed {done} files, {total / 1e6:.1f} MB in {elapsed:.2f}s "
+          f"({total / 1e6 / elapsed if elapsed else 0:.1f} MB/s), {failed} failed")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("operation", choices=("encrypt", "decrypt"))
+    parser.add_argument("src", help="file or directory to read")
+    parser.add_argument("dst", help="output file or directory")
+    parser.add_argument("-a", "--algorithm", default="AES")
+    parser.add_argument("-m", "--mode", default="GCM")
+    parser.add_argument("--container", action="store_true", help="write the segmented container format (AEAD modes)")
+    parser.add_argument("--compression", default="none", help="none, zlib, zstd or auto; implies --container")
+    parser.add_argument("--level", type=int, default=None, help="compression level")
+    parser.add_argument("--keys", default="keys.jsonl", help="key manifest written by encrypt, read by decrypt")
+    parser.add_argument("--key", help="decrypt: hex key for every file instead of a manifest")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.src):
+        parser.error(f"{args.src} does not exist")
+    return 1 if run(args) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Optional plaintext compression ahead of encryption.
+
+Ciphertext does not compress, so this has to happen before the cipher.
+The codec is recorded in the container header flags (see container.py),
+and readers undo it without being told. zlib is always available; zstd
+needs the optional `zstandard` package.
+
+"auto" picks zstd when it is installed, otherwise zlib, and falls back to
+no compression when a sample of the input already looks random (encrypted
+or compressed files, media), which would only cost CPU.
+
+Compressors can be suspended and resumed in another process (upload jobs
+do this between requests): zlib ends on a full flush and carries its
+Adler-32 over, zstd ends the frame and starts another one.
+"""
+import math
+import os
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Wire ids stored in the container flags; append, never renumber
+CODEC_IDS = {"none": 0, "zlib": 1, "zstd": 2}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+
+COMPRESSION_SAMPLE = int(os.environ.get("COMPRESSION_SAMPLE", 16 * 1024))
+# Bits per byte above which a sample is treated as incompressible
+ENTROPY_THRESHOLD = float(os.environ.get("COMPRESSION_ENTROPY_THRESHOLD", 7.5))
+# Most plaintext a decompressor hands back at once, however well the input compressed
+DECOMPRESS_PIECE_SIZE = int(os.environ.get("DECOMPRESS_PIECE_SIZE", 4 * 1024 * 1024))
+
+# A zstd block decodes to at most 128 KiB and takes at least 4 bytes (RLE)
+ZSTD_BLOCK_MAX = 128 * 1024
+ZSTD_BLOCK_MIN = 4
+# zlib header for deflate, 32 KiB window, default strategy
+ZLIB_HEADER = b"\x78\x9c"
+
+
+def sample_entropy(sample: bytes) -> float:
+    """Shannon entropy of the byte histogram, 0 (constant) to 8 (random)."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+
+def choose_codec(requested: str, sample: bytes) -> str:
+    """Resolve "auto" and skip compression for samples that look incompressible."""
+    if requested not in CODEC_IDS and requested != "auto":
+        raise ValueError(f"Unknown compression: {requested}")
+    if requested == "none":
+        return "none"
+    if requested == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+    if sample_entropy(sample[:COMPRESSION_SAMPLE]) > ENTROPY_THRESHOLD:
+        return "none"
+    if requested == "auto":
+        return "zstd" if zstandard is not None else "zlib"
+    return requested
+
+
+class _Passthrough:
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+    def suspend(self) -> tuple[bytes, dict]:
+        return b"", {}
+
+    def pieces(self, data, last: bool = False):
+        if data:
+            yield bytes(data)
+
+
+class _Zlib:
+    """zlib-format stream written as raw deflate, so it can stop and carry on elsewhere.
+
+    The header and Adler-32 trailer are added here; after a full flush a
+    new raw compressobj continues the same deflate stream.
+    """
+
+    def __init__(self, level: int, state: dict | None = None):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.checksum = state["adler32"] if state else 1
+        self._head = b"" if state else ZLIB_HEADER
+
+    def _output(self, data: bytes) -> bytes:
+        head, self._head = self._head, b""
+        return head + data if head else data
+
+    def compress(self, data) -> bytes:
+        self.checksum = zlib.adler32(data, self.checksum)
+        return self._output(self._obj.compress(data))
+
+    def flush(self) -> bytes:
+        return self._output(self._obj.flush() + self.checksum.to_bytes(4, "big"))
+
+    def suspend(self) -> tuple[bytes, dict]:
+        return self._output(self._obj.flush(zlib.Z_FULL_FLUSH)), {"adler32": self.checksum}
+
+
+class _Zstd:
+    """zstandard's compressobj behind the zlib compressobj interface."""
+
+    def __init__(self, level: int, state: dict | None = None):
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        self.compress = self._obj.compress
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    def suspend(self) -> tuple[bytes, dict]:
+        # Readers go on into the next frame
+        return self._obj.flush(), {}
+
+
+class _ZlibReader:
+    """zlib decompressobj with output capped through max_length."""
+
+    def __init__(self, max_length: int):
+        self._obj = zlib.decompressobj()
+        self.max_length = max_length
+
+    def pieces(self, data, last: bool = False):
+        while True:
+            piece = self._obj.decompress(data, self.max_length)
+            if piece:
+                yield piece
+            data = self._obj.unconsumed_tail
+            # A full piece may leave output pending inside zlib even with no input left
+            if not data and len(piece) < self.max_length:
+                break
+        if last:
+            piece = self._obj.flush()
+            if piece:
+                yield piece
+
+
+class _ZstdReader:
+    """zstandard's decompressobj, fed in slices so no call can return much.
+
+    It has no max_length, so the input is cut small enough that even all-RLE
+    blocks stay under half a piece, and output is gathered up to a piece.
+    """
+
+    def __init__(self, max_length: int):
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self._obj = zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+        self.max_length = max_length
+        self.slice = ZSTD_BLOCK_MIN * max(1, max_length // 2 // ZSTD_BLOCK_MAX - 1)
+        self._out = bytearray()
+
+    def pieces(self, data, last: bool = False):
+        view = memoryview(data)
+        for offset in range(0, len(view), self.slice):
+            self._out += self._obj.decompress(view[offset:offset + self.slice])
+            if len(self._out) >= self.max_length // 2:
+                yield bytes(self._out)
+                self._out.clear()
+        if last and self._out:
+            yield bytes(self._out)
+            self._out.clear()
+
+
+def compressor(codec: str, level: int | None = None, state: dict | None = None):
+    """Incremental compressor with compress(chunk) and flush().
+
+    suspend() flushes what it holds and returns it with a state; pass that
+    state back here to carry on the same stream.
+    """
+    if codec == "none":
+        return _Passthrough()
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "zlib":
+        return _Zlib(level, state)
+    return _Zstd(level, state)
+
+
+def decompressor(codec: str, max_length: int = DECOMPRESS_PIECE_SIZE):
+    """Incremental decompressor; pieces(chunk, last) yields output at most max_length at a time."""
+    if codec == "none":
+        return _Passthrough()
+    if codec == "zlib":
+        return _ZlibReader(max_length)
+    return _ZstdReader(max_length)
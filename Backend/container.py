@@ -0,0 +1,345 @@
+"""Versioned, segmented AEAD file format.
+
+Layout:
+
+    header   MAGIC | version | algorithm id | mode id | flags
+             | segment size (u32) | prefix length | nonce prefix
+    segments ciphertext (segment size bytes, last one shorter) | tag
+
+Every segment is sealed on its own with nonce = prefix | counter (u32) |
+last flag, and the header is authenticated as associated data of each
+segment (the STREAM construction used by age/Tink). Segments can therefore
+be opened in any order, a byte range only needs the segments covering it,
+and truncation or reordering fails verification.
+
+The low four flag bits name the compression codec applied to the
+plaintext stream before it was segmented (compression.CODEC_IDS); with a
+codec set, segments hold compressed bytes and byte ranges are unavailable.
+"""
+import base64
+import struct
+from typing import NamedTuple
+
+from compression import CODEC_IDS, CODEC_NAMES, compressor, decompressor
+from entropy import key_and_nonce
+from logic import CHUNK_SIZE, REGISTRY, TAG_SIZE, get_spec, split_aligned
+from metrics import BYTES_PROCESSED, stage
+
+MAGIC = b"HBYT"
+VERSION = 1
+SEGMENT_SIZE = CHUNK_SIZE
+
+# Fixed wire ids; append new entries, never renumber
+ALGORITHM_IDS = {"AES": 1, "DES": 2, "DES3": 3, "CAST-128": 4, "ChaCha20": 5}
+MODE_IDS = {"EAX": 1, "GCM": 2, "CCM": 3, "SIV": 4, "OCB": 5, "ChaCha20_Poly1305": 6}
+
+CODEC_MASK = 0x0F
+
+_FIXED = struct.Struct(">4sBBBBIB")
+_COUNTER = struct.Struct(">IB")
+
+
+class ContainerHeader(NamedTuple):
+    algorithm: str
+    mode: str
+    segment_size: int
+    nonce_prefix: bytes
+    flags: int = 0
+
+    @property
+    def compression(self) -> str:
+        return CODEC_NAMES[self.flags & CODEC_MASK]
+
+    @property
+    def size(self) -> int:
+        return _FIXED.size + len(self.nonce_prefix)
+
+    def pack(self) -> bytes:
+        return _FIXED.pack(
+            MAGIC, VERSION, ALGORITHM_IDS[self.algorithm], MODE_IDS[self.mode],
+            self.flags, self.segment_size, len(self.nonce_prefix),
+        ) + self.nonce_prefix
+
+    @classmethod
+    def parse(cls, data: bytes) -> "ContainerHeader":
+        if len(data) < _FIXED.size:
+            raise ValueError("Truncated container header")
+        magic, version, algorithm_id, mode_id, flags, segment_size, prefix_len = _FIXED.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a container file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported container version {version}")
+        algorithms = {v: k for k, v in ALGORITHM_IDS.items()}
+        modes = {v: k for k, v in MODE_IDS.items()}
+        if algorithm_id not in algorithms or mode_id not in modes or not segment_size:
+            raise ValueError("Corrupt container header")
+        if flags & CODEC_MASK not in CODEC_NAMES:
+            raise ValueError(f"Unsupported container compression {flags & CODEC_MASK}")
+        prefix = bytes(data[_FIXED.size:_FIXED.size + prefix_len])
+        if len(prefix) != prefix_len:
+            raise ValueError("Truncated container header")
+        return cls(algorithms[algorithm_id], modes[mode_id], segment_size, prefix, flags)
+
+
+# Enough bytes to parse any header: fixed part plus the longest nonce prefix
+HEADER_PEEK = _FIXED.size + 16
+
+
+def is_container(data: bytes) -> bool:
+    """True if data starts with a parseable container header."""
+    if not data.startswith(MAGIC):
+        return False
+    try:
+        header = ContainerHeader.parse(data)
+    except ValueError:
+        return False
+    return (header.algorithm.upper(), header.mode.upper()) in REGISTRY
+
+
+def _segment_cipher(key: bytes, header: ContainerHeader, packed: bytes, index: int, last: bool):
+    nonce = header.nonce_prefix + _COUNTER.pack(index, 1 if last else 0)
+    cipher = get_spec(header.algorithm, header.mode).new(key, nonce)
+    cipher.update(packed)
+    return cipher
+
+
+def seal_segment(key: bytes, header: ContainerHeader, index: int, data: bytes, last: bool, packed: bytes | None = None) -> bytes:
+    cipher = _segment_cipher(key, header, packed or header.pack(), index, last)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return ciphertext + tag
+
+
+def open_segment(key: bytes, header: ContainerHeader, index: int, blob: bytes, last: bool, packed: bytes | None = None) -> bytes:
+    """Decrypt and verify one segment; raises ValueError if it was tampered with."""
+    if len(blob) < TAG_SIZE:
+        raise ValueError("Truncated container segment")
+    cipher = _segment_cipher(key, header, packed or header.pack(), index, last)
+    return cipher.decrypt_and_verify(blob[:-TAG_SIZE], blob[-TAG_SIZE:])
+
+
+def segment_count(header: ContainerHeader, total_size: int) -> int:
+    """Number of segments in a container file of total_size bytes."""
+    body = total_size - header.size
+    stride = header.segment_size + TAG_SIZE
+    if body < TAG_SIZE:
+        raise ValueError("Truncated container file")
+    return max(1, -(-body // stride))
+
+
+def segment_span(header: ContainerHeader, index: int, total_size: int) -> tuple[int, int]:
+    """(start, end) file offsets of segment `index`, e.g. for an HTTP Range request."""
+    stride = header.segment_size + TAG_SIZE
+    start = header.size + index * stride
+    return start, min(start + stride, total_size)
+
+
+def iter_segments(header: ContainerHeader, data: bytes):
+    """Yield (index, blob, last) for every segment of an in-memory container."""
+    view = memoryview(data)
+    count = segment_count(header, len(data))
+    for index in range(count):
+        start, end = segment_span(header, index, len(data))
+        yield index, view[start:end], index == count - 1
+
+
+class ContainerWriter:
+    """Streaming encryptor for the container format.
+
+    Same interface as logic.StreamEncryptor; segments are emitted as soon as
+    they fill up, so nothing has to be held back (`deferred` is False).
+    With a compression codec the input is compressed on the way in.
+
+    suspend() and resume() let another process carry on the same file.
+    """
+
+    deferred = False
+
+    def __init__(self, algorithm: str, mode: str, segment_size: int = SEGMENT_SIZE, flags: int = 0,
+                 compression: str = "none", level: int | None = None):
+        spec = get_spec(algorithm, mode)
+        if not spec.aead:
+            raise ValueError(f"Container format requires an AEAD mode, got {spec.mode}")
+        self.algorithm, self.mode = spec.algorithm, spec.mode
+        self.key, prefix = key_and_nonce(spec.key_size, spec.nonce_size - _COUNTER.size)
+        self.compression = compression
+        self.level = level
+        self._compressor = compressor(compression, level) if compression != "none" else None
+        flags = flags & ~CODEC_MASK | CODEC_IDS[compression]
+        self.container_header = ContainerHeader(self.algorithm, self.mode, segment_size, prefix, flags)
+        self._packed = self.container_header.pack()
+        self._pending = bytearray()
+        self._index = 0
+
+    def header(self) -> bytes:
+        return self._packed
+
+    def _seal(self, data: bytes, last: bool) -> bytes:
+        blob = seal_segment(self.key, self.container_header, self._index, data, last, self._packed)
+        self._index += 1
+        return blob
+
+    def update(self, data: bytes) -> bytes:
+        BYTES_PROCESSED.inc(len(data), operation="encryption", algorithm=self.algorithm, mode=self.mode)
+        with stage("cipher", self.algorithm, self.mode):
+            if self._compressor:
+                data = self._compressor.compress(data)
+            return self._segments(data)
+
+    def _segments(self, data: bytes) -> bytes:
+        # A full segment is only sealed once more data follows, since the
+        # final segment carries the last flag
+        size = self.container_header.segment_size
+        return b"".join(
+            self._seal(part[offset:offset + size], last=False)
+            for part in split_aligned(self._pending, data, size, hold_back=True)
+            for offset in range(0, len(part), size)
+        )
+
+    def finalize(self) -> bytes:
+        with stage("cipher", self.algorithm, self.mode):
+            blobs = self._segments(self._compressor.flush()) if self._compressor else b""
+            blob = self._seal(bytes(self._pending), last=True)
+        self._pending = bytearray()
+        return blobs + blob
+
+    def suspend(self) -> tuple[bytes, dict]:
+        """Ciphertext still owed and a JSON-safe state for resume(); the key is not in it."""
+        blobs, codec_state = b"", {}
+        if self._compressor:
+            with stage("cipher", self.algorithm, self.mode):
+                flushed, codec_state = self._compressor.suspend()
+                blobs = self._segments(flushed)
+        return blobs, {
+            "header": self._packed.hex(),
+            "index": self._index,
+            "pending": base64.b64encode(self._pending).decode(),
+            "level": self.level,
+            "compressor": codec_state,
+        }
+
+    @classmethod
+    def resume(cls, key: bytes, state: dict) -> "ContainerWriter":
+        writer = cls.__new__(cls)
+        writer._packed = bytes.fromhex(state["header"])
+        writer.container_header = header = ContainerHeader.parse(writer._packed)
+        writer.algorithm, writer.mode = header.algorithm, header.mode
+        writer.key = key
+        writer.compression, writer.level = header.compression, state["level"]
+        writer._compressor = (
+            compressor(header.compression, writer.level, state["compressor"]) if header.compression != "none" else None
+        )
+        writer._pending = bytearray(base64.b64decode(state["pending"]))
+        writer._index = state["index"]
+        return writer
+
+
+class ContainerReader:
+    """Streaming decryptor for the container format.
+
+    Each segment is verified before its plaintext is returned, so output can
+    be released as it is produced (`verify_at_end` is False). finalize()
+    checks the last flag, which catches truncation at a segment boundary.
+    Compressed containers are decompressed on the way out; pieces() hands
+    the output back in bounded pieces, so a small input that inflates
+    enormously is never held whole.
+    """
+
+    verify_at_end = False
+
+    def __init__(self, key_hex: str, header: ContainerHeader):
+        self.key = bytes.fromhex(key_hex)
+        self.container_header = header
+        self.algorithm, self.mode = header.algorithm, header.mode
+        self.header_size = header.size
+        self._packed = header.pack()
+        self._pending = bytearray()
+        self._index = 0
+        self._decompressor = decompressor(header.compression) if header.compression != "none" else None
+
+    def _open(self, blob: bytes, last: bool) -> bytes:
+        with stage("cipher", self.algorithm, self.mode):
+            plaintext = open_segment(self.key, self.container_header, self._index, blob, last, self._packed)
+        self._index += 1
+        return plaintext
+
+    def _segments(self, data, last: bool):
+        stride = self.container_header.segment_size + TAG_SIZE
+        for part in split_aligned(self._pending, data, stride, hold_back=True):
+            for offset in range(0, len(part), stride):
+                yield self._open(part[offset:offset + stride], last=False)
+        if last:
+            blob, self._pending = bytes(self._pending), bytearray()
+            yield self._open(blob, last=True)
+
+    def pieces(self, data=b"", last: bool = False):
+        """Plaintext of data, one verified segment or decompressed piece at a time.
+
+        last=True also opens the final segment, as finalize() does.
+        """
+        BYTES_PROCESSED.inc(len(data), operation="decryption", algorithm=self.algorithm, mode=self.mode)
+        for plaintext in self._segments(data, last):
+            if self._decompressor:
+                yield from self._decompressor.pieces(plaintext)
+            else:
+                yield plaintext
+        if last and self._decompressor:
+            yield from self._decompressor.pieces(b"", last=True)
+
+    def update(self, data: bytes) -> bytes:
+        return b"".join(self.pieces(data))
+
+    def finalize(self) -> bytes:
+        return b"".join(self.pieces(last=True))
+
+
+def encrypt_container(data: bytes, algorithm: str, mode: str, segment_size: int = SEGMENT_SIZE,
+                      compression: str = "none", level: int | None = None):
+    """Container counterpart of logic.encrypt_bytes, same return shape."""
+    writer = ContainerWriter(algorithm, mode, segment_size, compression=compression, level=level)
+    combined = writer.header() + writer.update(data) + writer.finalize()
+    return combined, writer.key.hex(), writer.algorithm, writer.mode
+
+
+def decrypt_container(data: bytes, key_hex: str) -> bytes:
+    header = ContainerHeader.parse(data)
+    key = bytes.fromhex(key_hex)
+    packed = header.pack()
+    BYTES_PROCESSED.inc(len(data), operation="decryption", algorithm=header.algorithm, mode=header.mode)
+    with stage("cipher", header.algorithm, header.mode):
+        plaintext = b"".join(
+            open_segment(key, header, index, blob, last, packed)
+            for index, blob, last in iter_segments(header, data)
+        )
+    return decompress_all(header, plaintext)
+
+
+def decompress_all(header: ContainerHeader, plaintext: bytes) -> bytes:
+    """Undo the header's compression codec on a whole opened plaintext."""
+    if header.compression == "none":
+        return plaintext
+    return b"".join(decompressor(header.compression).pieces(plaintext, last=True))
+
+
+def decrypt_range(fileobj, key_hex: str, start: int, end: int) -> bytes:
+    """Return plaintext[start:end] from a seekable container file.
+
+    Only the segments overlapping the range are read and verified.
+    """
+    fileobj.seek(0, 2)
+    total_size = fileobj.tell()
+    fileobj.seek(0)
+    header = ContainerHeader.parse(fileobj.read(HEADER_PEEK))
+    if header.compression != "none":
+        raise ValueError("Byte ranges are not available on compressed containers")
+    key = bytes.fromhex(key_hex)
+    packed = header.pack()
+    count = segment_count(header, total_size)
+    size = header.segment_size
+    out = bytearray()
+    first = start // size
+    for index in range(first, min(count, -(-end // size))):
+        seg_start, seg_end = segment_span(header, index, total_size)
+        fileobj.seek(seg_start)
+        out += open_segment(key, header, index, fileobj.read(seg_end - seg_start), index == count - 1, packed)
+    offset = start - first * size
+    return bytes(out[offset:offset + max(0, end - start)])
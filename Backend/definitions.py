@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, Enum, DateTime, String
+from sqlalchemy import Column, Integer, Enum, DateTime, String, Index, LargeBinary
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, Field
+from typing import Literal
 
 BASE = declarative_base()
 
@@ -14,15 +15,65 @@ class Table(BASE):
     algorithm = Column(String, nullable=False)
     mode = Column(String, nullable=False)
     operation = Column(String, nullable=False)
-    performed_at = Column(DateTime, default=datetime.now())
+    performed_at = Column(DateTime, default=datetime.now)
+
+    # Keyset pages walk (performed_at, id); the filtered variants let a
+    # filter plus time range stay on the index
+    __table_args__ = (
+        Index("ix_operations_performed_at_id", "performed_at", "id"),
+        Index("ix_operations_operation_performed_at", "operation", "performed_at", "id"),
+        Index("ix_operations_algorithm_mode_performed_at", "algorithm", "mode", "performed_at", "id"),
+    )
+
+class HourlyStats(BASE):
+    """Operation counts per hour, kept up to date by the audit writer."""
+    __tablename__ = "operation_stats"
+
+    hour = Column(DateTime, primary_key=True)
+    operation = Column(String, primary_key=True)
+    algorithm = Column(String, primary_key=True)
+    mode = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class StoredKey(BASE):
+    """Registered cipher key, wrapped with the keystore master key."""
+    __tablename__ = "keys"
+
+    key_id = Column(String, primary_key=True)
+    algorithm = Column(String, nullable=False)
+    mode = Column(String, nullable=False)
+    wrapped = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
 
 class EncryptRequest(BaseModel):
     text: str = Field(None, description="Text to encrypt")
     algorithm: str = Field(None, description="Algorithm used")
     mode: str = Field(None, description="Cipher mode used")
+    encoding: Literal["base64", "base64url", "hex"] = Field("base64", description="Encoding of the returned cipher")
+    store_key: bool = Field(False, description="Keep the key server side and return a key_id for decryption")
 
 class DecryptRequest(BaseModel):
     cipher: str
-    key: str
+    key: str | None = Field(None, description="Hex key; either this or key_id")
+    key_id: str | None = Field(None, description="Id of a stored key; algorithm and mode come with it")
+    mode: str | None = None
+    algorithm: str = Field(None, description="Algorithm used")
+    encoding: Literal["base64", "base64url", "hex"] = Field("base64", description="Encoding of the cipher")
+
+MAX_BATCH_ITEMS = 1000
+
+class EncryptBatchRequest(BaseModel):
+    items: list[EncryptRequest] = Field(..., max_length=MAX_BATCH_ITEMS, description="Texts to encrypt")
+
+class DecryptBatchRequest(BaseModel):
+    items: list[DecryptRequest] = Field(..., max_length=MAX_BATCH_ITEMS, description="Ciphers to decrypt")
+
+class JobRequest(BaseModel):
+    algorithm: str
     mode: str
-    algorithm: str = Field(None, description="Algorithm used")
\ No newline at end of file
+    length: int = Field(..., ge=0, description="Total plaintext size in bytes")
+    filename: str = Field("", description="Original file name, used for the download name")
+    container: bool = Field(True, description="Jobs always write the container format, so any worker can resume them")
+    compression: str = "none"
+    compression_level: int | None = None
+    store_key: bool = False
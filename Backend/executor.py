@@ -0,0 +1,249 @@
+"""Thread pool for running cipher work off the event loop.
+
+pycryptodome releases the GIL inside its C primitives, so threads scale
+across cores. Payloads under INLINE_THRESHOLD are cheaper to handle inline
+than to hand over to a thread. Payloads over SPLIT_THRESHOLD are cut into
+independent pieces when the mode allows it (CTR, ECB, CBC decryption and
+container segments) and reassembled in order.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logic import decrypt_bytes, encrypt_bytes, get_spec, pad_data, unpad_data
+from container import ContainerHeader, ContainerWriter, decompress_all, iter_segments, open_segment, seal_segment
+from entropy import key_and_nonce
+from metrics import BYTES_PROCESSED, STAGE_SECONDS
+
+CRYPTO_WORKERS = int(os.environ.get("CRYPTO_WORKERS", os.cpu_count() or 1))
+INLINE_THRESHOLD = int(os.environ.get("CRYPTO_INLINE_THRESHOLD", 64 * 1024))
+SPLIT_THRESHOLD = int(os.environ.get("CRYPTO_SPLIT_THRESHOLD", 4 * 1024 * 1024))
+
+_pool: ThreadPoolExecutor | None = None
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+    return _pool
+
+
+def configure(workers: int):
+    """Resize the pool; used by benchmarks and tests."""
+    global CRYPTO_WORKERS
+    shutdown()
+    CRYPTO_WORKERS = workers
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+async def run(fn, *args, size: int | None = None):
+    """Run fn(*args) in the pool, or inline when `size` is under INLINE_THRESHOLD."""
+    if size is not None and size < INLINE_THRESHOLD:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), fn, *args)
+
+
+def _pieces(length: int, align: int) -> list[tuple[int, int]]:
+    piece = max(align, -(-length // CRYPTO_WORKERS))
+    piece += -piece % align
+    return [(start, min(start + piece, length)) for start in range(0, length, piece)]
+
+
+# Jobs take views of the output buffer only while they run, so finish() can
+# still trim it in place afterwards
+
+def _ctr_jobs(spec, key, nonce, src, buffer, offset):
+    block_size = spec.block_size
+
+    def job(start, end):
+        cipher = spec.new(key, nonce, initial_value=start // block_size)
+        cipher.encrypt(src[start:end], output=memoryview(buffer)[offset + start:offset + end])
+
+    return [lambda s=s, e=e: job(s, e) for s, e in _pieces(len(src), block_size)]
+
+
+def _ecb_jobs(spec, key, src, buffer, decrypt=False):
+    block_size = spec.block_size
+
+    def job(start, end):
+        cipher = spec.new(key)
+        step = cipher.decrypt if decrypt else cipher.encrypt
+        step(src[start:end], output=memoryview(buffer)[start:end])
+
+    return [lambda s=s, e=e: job(s, e) for s, e in _pieces(len(src), block_size)]
+
+
+def _measured(jobs, finish, operation: str, algorithm: str, mode: str, size: int):
+    """Plan whose finish() records the bytes and the cipher stage, timed from planning on.
+
+    The jobs run on several threads, so the stage is the wall time of the
+    whole plan rather than a sum over the jobs.
+    """
+    started = time.perf_counter()
+
+    def measured_finish():
+        result = finish()
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="cipher", algorithm=algorithm, mode=mode)
+        BYTES_PROCESSED.inc(size, operation=operation, algorithm=algorithm, mode=mode)
+        return result
+
+    return jobs, measured_finish
+
+
+def split_encrypt(data: bytes, algorithm: str, mode: str):
+    """Plan a parallel encrypt_bytes: (jobs, finish) or None if the mode is sequential.
+
+    Every job is independent; once all have run, finish() returns the same
+    tuple as encrypt_bytes.
+    """
+    spec = get_spec(algorithm, mode)
+    if spec.mode not in ("CTR", "ECB"):
+        return None
+    src = memoryview(data)
+    key, nonce = key_and_nonce(spec.key_size, spec.nonce_size)
+    block_size = spec.block_size
+
+    if spec.mode == "CTR":
+        buffer = bytearray(len(nonce) + len(data))
+        buffer[:len(nonce)] = nonce
+        jobs = _ctr_jobs(spec, key, nonce, src, buffer, len(nonce))
+    else:
+        full = len(data) - len(data) % block_size
+        buffer = bytearray(full + block_size)
+        jobs = _ecb_jobs(spec, key, src[:full], buffer)
+        tail = pad_data(bytes(src[full:]), block_size)
+        jobs.append(lambda: spec.new(key).encrypt(tail, output=memoryview(buffer)[full:]))
+
+    def finish():
+        return buffer, key.hex(), spec.algorithm, spec.mode
+
+    return _measured(jobs, finish, "encryption", spec.algorithm, spec.mode, len(data))
+
+
+def split_decrypt(ciphertext, key_hex: str, algorithm: str, mode: str):
+    """Plan a parallel decrypt_bytes: (jobs, finish) or None if the mode is sequential."""
+    spec = get_spec(algorithm, mode)
+    if spec.mode not in ("CTR", "ECB", "CBC"):
+        return None
+    raw = ciphertext
+    src = memoryview(raw)
+    key = bytes.fromhex(key_hex)
+    block_size = spec.block_size
+
+    if spec.mode == "CTR":
+        nonce_size = spec.nonce_size
+        buffer = bytearray(len(raw) - nonce_size)
+        jobs = _ctr_jobs(spec, key, bytes(src[:nonce_size]), src[nonce_size:], buffer, 0)
+    elif spec.mode == "ECB":
+        if len(raw) % block_size != 0:
+            raise ValueError(f"Ciphertext length {len(raw)} not aligned to {block_size}-byte block for ECB")
+        buffer = bytearray(len(raw))
+        jobs = _ecb_jobs(spec, key, src, buffer, decrypt=True)
+    else:
+        # Each plaintext block only needs the previous ciphertext block
+        iv_size = spec.nonce_size
+        body = src[iv_size:]
+        if len(body) % block_size != 0:
+            raise ValueError(f"Ciphertext length not aligned to {block_size}-byte block for CBC")
+        buffer = bytearray(len(body))
+
+        def job(start, end):
+            iv = bytes(body[start - block_size:start]) if start else bytes(src[:iv_size])
+            spec.new(key, iv).decrypt(body[start:end], output=memoryview(buffer)[start:end])
+
+        jobs = [lambda s=s, e=e: job(s, e) for s, e in _pieces(len(body), block_size)]
+
+    def finish():
+        return unpad_data(buffer, block_size) if spec.padded else buffer
+
+    return _measured(jobs, finish, "decryption", spec.algorithm, spec.mode, len(raw))
+
+
+def _segment_batches(count: int) -> list[range]:
+    return [range(start, end) for start, end in _pieces(count, 1)]
+
+
+def split_container_encrypt(data: bytes, algorithm: str, mode: str):
+    """Plan a parallel container.encrypt_container; segments are sealed in batches."""
+    writer = ContainerWriter(algorithm, mode)
+    header = writer.container_header
+    packed = writer.header()
+    size = header.segment_size
+    src = memoryview(data)
+    count = max(1, -(-len(data) // size))
+    segments = [None] * count
+
+    def job(indexes):
+        for index in indexes:
+            chunk = src[index * size:(index + 1) * size]
+            segments[index] = seal_segment(writer.key, header, index, chunk, index == count - 1, packed)
+
+    def finish():
+        return packed + b"".join(segments), writer.key.hex(), writer.algorithm, writer.mode
+
+    jobs = [lambda r=r: job(r) for r in _segment_batches(count)]
+    return _measured(jobs, finish, "encryption", writer.algorithm, writer.mode, len(data))
+
+
+def split_container_decrypt(data: bytes, key_hex: str):
+    """Plan a parallel container.decrypt_container; segments are opened in batches."""
+    header = ContainerHeader.parse(data)
+    packed = header.pack()
+    key = bytes.fromhex(key_hex)
+    entries = list(iter_segments(header, data))
+    plaintexts = [None] * len(entries)
+
+    def job(indexes):
+        for index in indexes:
+            _, blob, last = entries[index]
+            plaintexts[index] = open_segment(key, header, index, blob, last, packed)
+
+    def finish():
+        return decompress_all(header, b"".join(plaintexts))
+
+    jobs = [lambda r=r: job(r) for r in _segment_batches(len(entries))]
+    return _measured(jobs, finish, "decryption", header.algorithm, header.mode, len(data))
+
+
+def run_parallel(plan):
+    """Synchronous driver for a split plan, for scripts and benchmarks."""
+    jobs, finish = plan
+    for future in [get_pool().submit(job) for job in jobs]:
+        future.result()
+    return finish()
+
+
+async def _run_plan(plan):
+    jobs, finish = plan
+    await asyncio.gather(*(run(job) for job in jobs))
+    return await run(finish)
+
+
+async def encrypt_async(data: bytes, algorithm: str, mode: str):
+    """encrypt_bytes that keeps the event loop free and uses every core for big inputs."""
+    if len(data) < INLINE_THRESHOLD:
+        return encrypt_bytes(data, algorithm, mode)
+    if len(data) >= SPLIT_THRESHOLD:
+        plan = split_encrypt(data, algorithm, mode)
+        if plan is not None:
+            return await _run_plan(plan)
+    return await run(encrypt_bytes, data, algorithm, mode)
+
+
+async def decrypt_async(ciphertext, key_hex: str, algorithm: str, mode: str) -> bytearray:
+    """decrypt_bytes that keeps the event loop free and uses every core for big inputs."""
+    if len(ciphertext) < INLINE_THRESHOLD:
+        return decrypt_bytes(ciphertext, key_hex, algorithm, mode)
+    if len(ciphertext) >= SPLIT_THRESHOLD:
+        plan = await run(split_decrypt, ciphertext, key_hex, algorithm, mode)
+        if plan is not None:
+            return await _run_plan(plan)
+    return await run(decrypt_bytes, ciphertext, key_hex, algorithm, mode)
@@ -0,0 +1,296 @@
+"""Resumable, chunked file encryption jobs.
+
+Flow, modelled on the tus protocol:
+
+    POST   /jobs                 declare algorithm, mode and total length
+    PATCH  /jobs/{id}            send bytes at Upload-Offset (409 if it is not
+                                 the current offset)
+    HEAD   /jobs/{id}            current Upload-Offset, to resume after a drop
+    GET    /jobs/{id}            status and progress
+    GET    /jobs/{id}/ciphertext the encrypted file once status is "done"
+    DELETE /jobs/{id}
+
+Bytes are encrypted in the crypto pool as they arrive and the ciphertext is
+appended to JOBS_DIR/<id>/, so no plaintext and no whole file is ever held.
+A dropped connection keeps every byte that was processed, and the client
+resumes from the offset HEAD reports. Jobs idle for longer than JOB_TTL
+seconds are deleted.
+
+Jobs always write the container format (container.py), so an AEAD mode is
+required: its segments are sealed independently, which lets the writer
+stop after every request and carry on anywhere. Between requests the job
+lives in JOBS_DIR/<id>/state.json: progress, the key wrapped under the
+keystore master key, and the writer's segment index, partial segment and
+compressor state. Any worker sharing JOBS_DIR can take the next request,
+also after a restart; an upload holds JOBS_DIR/<id>/lock, and a second
+one to the same job gets a conflict.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+
+import executor
+from compression import COMPRESSION_SAMPLE, choose_codec
+from container import ContainerWriter
+from keystore import keystore, unwrap, wrap
+from locks import try_lock
+from logic import get_spec
+from metrics import Gauge
+
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")
+JOB_TTL = float(os.environ.get("JOB_TTL", 3600))
+JOB_CLEANUP_INTERVAL = float(os.environ.get("JOB_CLEANUP_INTERVAL", 60))
+
+# Job attributes written to state.json as they are
+PERSISTED = (
+    "algorithm", "mode", "length", "filename", "compression", "level", "store_key",
+    "offset", "written", "status", "error", "key_id", "wrapped_key", "writer_state",
+)
+
+
+def _is_job_id(name: str) -> bool:
+    """Job ids are uuid4().hex: 32 lowercase hex digits."""
+    return len(name) == 32 and all(c in "0123456789abcdef" for c in name)
+
+
+def _job_ids() -> list[str]:
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    return [name for name in os.listdir(JOBS_DIR) if _is_job_id(name) and os.path.isdir(os.path.join(JOBS_DIR, name))]
+
+
+def _last_modified(directory: str) -> float:
+    """Newest mtime of the directory and the files in it; appends only touch the files."""
+    try:
+        with os.scandir(directory) as entries:
+            return max([os.stat(directory).st_mtime] + [entry.stat().st_mtime for entry in entries])
+    except OSError:
+        return time.time()
+
+
+class JobConflict(ValueError):
+    """Upload at the wrong offset, or while another upload to the job is running."""
+
+
+class Job:
+    def __init__(self, algorithm: str, mode: str, length: int, filename: str = "",
+                 compression: str = "none", level: int | None = None, store_key: bool = False,
+                 job_id: str | None = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.algorithm, self.mode = algorithm, mode
+        self.length = length
+        self.filename = filename
+        self.compression = compression
+        self.level = level
+        self.offset = 0
+        self.written = 0
+        self.status = "uploading"
+        self.error = None
+        self.key = None
+        self.wrapped_key = None
+        self.key_id = None
+        self.store_key = store_key
+        # ContainerWriter.suspend() state between requests
+        self.writer_state = None
+        self.directory = os.path.join(JOBS_DIR, self.id)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @property
+    def header_path(self) -> str:
+        return self._path("header")
+
+    @property
+    def body_path(self) -> str:
+        return self._path("body")
+
+    def describe(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "algorithm": self.algorithm,
+            "mode": self.mode,
+            "offset": self.offset,
+            "length": self.length,
+            "progress": self.offset / self.length if self.length else 1.0,
+            "ciphertext_bytes": self.written,
+            "compression": self.compression,
+            "error": self.error,
+        }
+
+    def save(self):
+        """Replace state.json atomically; the body it counts must already be synced."""
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self._path("state.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump({name: getattr(self, name) for name in PERSISTED}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._path("state.json"))
+
+    @classmethod
+    def load(cls, job_id: str) -> "Job":
+        """Raises KeyError for unknown or expired jobs."""
+        if not _is_job_id(job_id):
+            raise KeyError(job_id)
+        job = cls("", "", 0, job_id=job_id)
+        try:
+            with open(job._path("state.json")) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(job_id)
+        for name in PERSISTED:
+            setattr(job, name, state[name])
+        if job.wrapped_key:
+            job.key = unwrap(keystore.master, job.id, job.algorithm, job.mode, bytes.fromhex(job.wrapped_key)).hex()
+        return job
+
+    def _start(self, first: bytes) -> ContainerWriter:
+        self.compression = choose_codec(self.compression, first[:COMPRESSION_SAMPLE])
+        writer = ContainerWriter(self.algorithm, self.mode, compression=self.compression, level=self.level)
+        self.key = writer.key.hex()
+        self.wrapped_key = wrap(keystore.master, self.id, self.algorithm, self.mode, writer.key).hex()
+        with open(self.header_path, "wb") as f:
+            f.write(writer.header())
+            f.flush()
+            os.fsync(f.fileno())
+        return writer
+
+    def _open_body(self):
+        out = open(self.body_path, "ab")
+        # Ciphertext past `written` is from a request that died before saving its state
+        out.truncate(self.written)
+        return out
+
+    def _append(self, out, data: bytes):
+        out.write(data)
+        self.written += len(data)
+
+    def _suspend(self, out, writer: ContainerWriter | None):
+        """Park the writer and sync the body, then save the state that counts it."""
+        if writer is not None and self.status == "uploading":
+            blobs, self.writer_state = writer.suspend()
+            self._append(out, blobs)
+        elif self.status != "uploading":
+            self.writer_state = None
+        if out is not None:
+            out.flush()
+            os.fsync(out.fileno())
+            out.close()
+        self.save()
+
+
+class JobManager:
+    def create(self, algorithm: str, mode: str, length: int, **options) -> Job:
+        if length < 0:
+            raise ValueError("Upload length must not be negative")
+        # Fail here rather than on the first chunk
+        spec = get_spec(algorithm, mode)
+        if not spec.aead:
+            raise ValueError(f"Jobs write the container format, which requires an AEAD mode, got {spec.mode}")
+        choose_codec(options.get("compression", "none"), b"")
+        job = Job(spec.algorithm, spec.mode, length, **options)
+        job.save()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """Raises KeyError for unknown or expired jobs."""
+        return Job.load(job_id)
+
+    async def save(self, job: Job):
+        await asyncio.to_thread(job.save)
+
+    async def append(self, job: Job, offset: int, chunks) -> int:
+        """Encrypt the bytes of `chunks` (an async iterator) starting at offset; returns the new offset.
+
+        Whatever arrived before a failure or disconnect stays counted.
+        """
+        if not os.path.isdir(job.directory):
+            raise KeyError(job.id)
+        with try_lock(job._path("lock")) as held:
+            if not held:
+                raise JobConflict("Another upload to this job is in progress")
+            # Another worker may have moved the job on since it was read
+            job.__dict__.update((await asyncio.to_thread(Job.load, job.id)).__dict__)
+            if job.status != "uploading":
+                raise JobConflict(f"Job is {job.status}")
+            if offset != job.offset:
+                raise JobConflict(f"Upload-Offset is {job.offset}, not {offset}")
+            out = writer = None
+            try:
+                out = await asyncio.to_thread(job._open_body)
+                if job.writer_state:
+                    writer = ContainerWriter.resume(bytes.fromhex(job.key), job.writer_state)
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if job.offset + len(chunk) > job.length:
+                        raise ValueError(f"Upload exceeds the declared length of {job.length} bytes")
+                    if writer is None:
+                        writer = await asyncio.to_thread(job._start, chunk)
+                    ciphertext = await executor.run(writer.update, chunk, size=len(chunk))
+                    await asyncio.to_thread(job._append, out, ciphertext)
+                    job.offset += len(chunk)
+                if job.offset == job.length:
+                    if writer is None:
+                        writer = await asyncio.to_thread(job._start, b"")
+                    await asyncio.to_thread(job._append, out, await executor.run(writer.finalize))
+                    job.status = "done"
+            except ValueError:
+                raise
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+                raise
+            finally:
+                await asyncio.to_thread(job._suspend, out, writer)
+        return job.offset
+
+    def delete(self, job_id: str) -> bool:
+        """Remove a job's directory; raises JobConflict while an upload to it is running."""
+        directory = os.path.join(JOBS_DIR, job_id)
+        if not _is_job_id(job_id) or not os.path.isdir(directory):
+            return False
+        with try_lock(os.path.join(directory, "lock")) as held:
+            if not held:
+                raise JobConflict("An upload to this job is in progress")
+            shutil.rmtree(directory, ignore_errors=True)
+        return True
+
+    def cleanup(self, ttl: float = JOB_TTL) -> int:
+        """Delete jobs idle for longer than ttl; returns how many went.
+
+        Workers share JOBS_DIR, so this also removes jobs another worker or
+        an earlier process left behind; jobs being uploaded to are skipped.
+        """
+        cutoff = time.time() - ttl
+        removed = 0
+        for job_id in _job_ids():
+            if _last_modified(os.path.join(JOBS_DIR, job_id)) >= cutoff:
+                continue
+            try:
+                removed += self.delete(job_id)
+            except JobConflict:
+                continue
+        return removed
+
+    async def run_cleanup(self, interval: float = JOB_CLEANUP_INTERVAL):
+        """Background loop started by the app lifespan."""
+        while True:
+            await asyncio.sleep(interval)
+            self.cleanup()
+
+    async def stream(self, job: Job):
+        """Yield the finished ciphertext file in chunks."""
+        for path in (job.header_path, job.body_path):
+            with open(path, "rb") as f:
+                while block := await asyncio.to_thread(f.read, 1024 * 1024):
+                    yield block
+
+
+jobs = JobManager()
+
+Gauge("hashbytes_jobs_active", "Encryption jobs not yet deleted", lambda: len(_job_ids()))
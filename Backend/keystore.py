@@ -0,0 +1,138 @@
+"""Server-side key registry.
+
+With store_key set, an encrypt call also saves its key under a random
+key_id, and decrypt calls can then send key_id instead of the hex key.
+Keys are wrapped with AES-256-GCM under a master key before they reach the
+database. The key_id, algorithm and mode are bound as associated data, so
+a wrapped key copied onto another row does not unwrap.
+
+The master key comes from KEYSTORE_MASTER_KEY (64 hex chars). Without it, a
+key is generated on first use and kept in KEYSTORE_MASTER_KEY_FILE. Losing
+that file loses every stored key.
+
+Resolved keys stay in an LRU cache (KEY_CACHE_SIZE entries, KEY_CACHE_TTL
+seconds), so repeated decrypts with one key_id skip the database and the
+unwrap.
+
+Audit rows for a stored key record "key_id:<id>" in place of the key, so
+neither the operations table nor its archive holds it in the clear.
+"""
+import os
+import uuid
+
+from sqlalchemy import insert, select
+
+import audit
+from audit import audit_log
+from cache import TTLCache
+from definitions import StoredKey
+from entropy import random_bytes
+from logic import get_spec
+
+KEYSTORE_MASTER_KEY = os.environ.get("KEYSTORE_MASTER_KEY", "")
+KEYSTORE_MASTER_KEY_FILE = os.environ.get("KEYSTORE_MASTER_KEY_FILE", "master.key")
+KEY_CACHE_SIZE = int(os.environ.get("KEY_CACHE_SIZE", 10000))
+KEY_CACHE_TTL = float(os.environ.get("KEY_CACHE_TTL", 300))
+
+_WRAP = get_spec("AES", "GCM")
+_WRAP_NONCE = _WRAP.nonce_size
+_WRAP_TAG = 16
+
+
+def load_master_key(path: str = KEYSTORE_MASTER_KEY_FILE) -> bytes:
+    if KEYSTORE_MASTER_KEY:
+        key = bytes.fromhex(KEYSTORE_MASTER_KEY)
+    elif os.path.exists(path):
+        with open(path) as f:
+            key = bytes.fromhex(f.read().strip())
+    else:
+        key = random_bytes(32)
+        # O_EXCL: if another worker won the race, use its key instead
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return load_master_key(path)
+        with os.fdopen(fd, "w") as f:
+            f.write(key.hex())
+    if len(key) != 32:
+        raise ValueError("Keystore master key must be 32 bytes")
+    return key
+
+
+def _associated(key_id: str, algorithm: str, mode: str) -> bytes:
+    return f"{key_id}|{algorithm}|{mode}".encode()
+
+
+def wrap(master: bytes, key_id: str, algorithm: str, mode: str, key: bytes) -> bytes:
+    nonce = random_bytes(_WRAP_NONCE)
+    cipher = _WRAP.new(master, nonce)
+    cipher.update(_associated(key_id, algorithm, mode))
+    ciphertext, tag = cipher.encrypt_and_digest(key)
+    return nonce + tag + ciphertext
+
+
+def unwrap(master: bytes, key_id: str, algorithm: str, mode: str, wrapped: bytes) -> bytes:
+    nonce, tag = wrapped[:_WRAP_NONCE], wrapped[_WRAP_NONCE:_WRAP_NONCE + _WRAP_TAG]
+    cipher = _WRAP.new(master, nonce)
+    cipher.update(_associated(key_id, algorithm, mode))
+    return cipher.decrypt_and_verify(wrapped[_WRAP_NONCE + _WRAP_TAG:], tag)
+
+
+def key_reference(key_hex: str, key_id: str | None) -> str:
+    """Value for the audit cipher_key column; a stored key is named by its key_id, never written out."""
+    return f"key_id:{key_id}" if key_id else key_hex
+
+
+def _insert(db, rows: list[dict]):
+    db.execute(insert(StoredKey), rows)
+    db.commit()
+
+
+def _fetch(db, key_id: str):
+    return db.execute(
+        select(StoredKey.algorithm, StoredKey.mode, StoredKey.wrapped).where(StoredKey.key_id == key_id)
+    ).first()
+
+
+class KeyStore:
+    def __init__(self, cache_size: int = KEY_CACHE_SIZE, ttl: float = KEY_CACHE_TTL):
+        self.cache = TTLCache("keys", cache_size, ttl)
+        self._master = None
+
+    @property
+    def master(self) -> bytes:
+        if self._master is None:
+            self._master = load_master_key()
+        return self._master
+
+    async def register(self, key_hex: str, algorithm: str, mode: str) -> str:
+        return (await self.register_many([(key_hex, algorithm, mode)]))[0]
+
+    async def register_many(self, keys: list[tuple[str, str, str]]) -> list[str]:
+        """Store (key hex, algorithm, mode) entries; returns their key_ids in order."""
+        rows = []
+        for key_hex, algorithm, mode in keys:
+            key_id = uuid.uuid4().hex
+            wrapped = wrap(self.master, key_id, algorithm, mode, bytes.fromhex(key_hex))
+            rows.append(dict(key_id=key_id, algorithm=algorithm, mode=mode, wrapped=wrapped))
+            self.cache.put(key_id, (key_hex, algorithm, mode))
+        if rows:
+            await audit.setup()
+            await audit_log.storage.run(_insert, rows)
+        return [row["key_id"] for row in rows]
+
+    async def resolve(self, key_id: str) -> tuple[str, str, str]:
+        """(key hex, algorithm, mode) for key_id; raises KeyError if it is unknown."""
+        entry = self.cache.get(key_id)
+        if entry is not None:
+            return entry
+        await audit.setup()
+        row = await audit_log.storage.run(_fetch, key_id)
+        if row is None:
+            raise KeyError(key_id)
+        entry = (unwrap(self.master, key_id, row.algorithm, row.mode, row.wrapped).hex(), row.algorithm, row.mode)
+        self.cache.put(key_id, entry)
+        return entry
+
+
+keystore = KeyStore()
@@ -0,0 +1,36 @@
+"""Non-blocking cross-process file locks.
+
+Used where several uvicorn workers, or hosts sharing a directory, must
+not run the same thing at once: retention passes and job uploads.
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def try_lock(path: str):
+    """Yield True while holding an exclusive lock on path, False if another holder has it.
+
+    Separate opens conflict even within one process, so this also keeps two
+    tasks of the same worker apart.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            yield False
+            return
+        # Closing the descriptor releases the lock
+        yield True
+    finally:
+        os.close(fd)
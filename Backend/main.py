@@ -1,189 +1,642 @@
-from definitions import Table, BASE, EncryptRequest, DecryptRequest
+from definitions import EncryptRequest, DecryptRequest, EncryptBatchRequest, DecryptBatchRequest, JobRequest
 
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, Form, File, Request
+from fastapi import APIRouter, FastAPI, HTTPException, UploadFile, Form, File, Request, Header, Query
+from starlette.requests import ClientDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, HTMLResponse, JSONResponse, Response, PlainTextResponse
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import datetime
 from pathlib import Path
-from logic import encrypt_text, encrypt_file, decrypt_file, decrypt_text
-import base64
-from io import BytesIO
+from logic import StreamEncryptor, StreamDecryptor, CHUNK_SIZE, encrypt_bytes, decrypt_bytes, encode_bytes, decode_text, load_ciphers, metric_labels
+from executor import encrypt_async, decrypt_async
+from audit import audit_log, naive_local, query_operations, query_stats
+import audit
+import executor
+import retention
+from container import ContainerHeader, ContainerReader, ContainerWriter, HEADER_PEEK, is_container
+from keystore import key_reference, keystore
+from compression import COMPRESSION_SAMPLE, choose_codec
+from jobs import JobConflict, jobs
+from metrics import MetricsMiddleware, stage
+from admission import AdmissionMiddleware
+import metrics
+from tempfile import SpooledTemporaryFile
+import asyncio
+import os
 import traceback
 
-DATABASE_URL = "sqlite:///audit.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# With 0, nothing is warmed up: schema, templates and cipher modules load on first use
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") == "1"
 
-BASE.metadata.create_all(bind=engine)
+@lru_cache(maxsize=None)
+def get_templates():
+    # jinja2 is only needed for the index page
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="templates")
 
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], 
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["key", "filename"]
-)
-templates = Jinja2Templates(directory="templates")
+async def warmup(state):
+    """Do the slow one-off startup work in the background; /ready reports when it is done."""
+    try:
+        await audit.setup()
+        await asyncio.to_thread(load_ciphers)
+        await asyncio.to_thread(get_templates)
+        state.ready = True
+    except Exception as e:
+        state.warmup_error = str(e)
+        print("Startup warmup failed:")
+        traceback.print_exc()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve straight away; anything that needs the schema waits on audit.setup()
+    app.state.ready, app.state.warmup_error = not STARTUP_WARMUP, None
+    warmup_task = asyncio.create_task(warmup(app.state)) if STARTUP_WARMUP else None
+    audit_log.start()
+    retention_task = asyncio.create_task(retention.run_forever()) if retention.retention_enabled() else None
+    jobs.cleanup()
+    jobs_task = asyncio.create_task(jobs.run_cleanup())
+    yield
+    jobs_task.cancel()
+    if retention_task:
+        retention_task.cancel()
+    if warmup_task:
+        warmup_task.cancel()
+    await audit_log.stop()
+    await audit_log.storage.close()
+    executor.shutdown()
+
+# JSON and text routes only; ciphertext and binary downloads don't shrink
+GZIP_PATHS = {
+    "/encrypt-text", "/decrypt-text", "/encrypt-text/batch", "/decrypt-text/batch",
+    "/audit/operations", "/audit/stats", "/audit/archive", "/metrics",
+}
+
+class TextGZipMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=500, compresslevel=6)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in GZIP_PATHS:
+            return await self.gzip(scope, receive, send)
+        await self.app(scope, receive, send)
+
+router = APIRouter()
+
+# AEAD ciphertext is held here until the tag is known; spills to disk above this size
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+async def read_chunk(file: UploadFile, crypto, size: int = CHUNK_SIZE):
+    with stage("read", crypto.algorithm, crypto.mode):
+        return await file.read(size)
+
+async def read_body(request: Request, algorithm: str, mode: str):
+    with stage("read", *metric_labels(algorithm, mode)):
+        return await request.body()
+
+async def resolve_key(key: str | None, key_id: str | None, algorithm: str | None, mode: str | None):
+    """(key hex, algorithm, mode) from either a hex key or a stored key_id."""
+    if key_id:
+        try:
+            return await keystore.resolve(key_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Unknown key_id")
+    if not key:
+        raise HTTPException(status_code=400, detail="key or key_id is required")
+    return key, algorithm, mode
+
+async def stream_spool(spool):
+    """Yield a spooled temporary file back in chunks and close it."""
+    try:
+        spool.seek(0)
+        while block := spool.read(CHUNK_SIZE):
+            yield block
+    finally:
+        spool.close()
+
+async def encrypt_upload(file: UploadFile, encryptor):
+    """Encrypt an upload chunk by chunk and yield the ciphertext file."""
+    try:
+        if not encryptor.deferred:
+            yield encryptor.header()
+            while chunk := await read_chunk(file, encryptor):
+                yield await executor.run(encryptor.update, chunk, size=len(chunk))
+            yield await executor.run(encryptor.finalize)
+            return
+
+        # The tag sits in front of the ciphertext, so spool it until finalize()
+        spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        while chunk := await read_chunk(file, encryptor):
+            spool.write(await executor.run(encryptor.update, chunk, size=len(chunk)))
+        spool.write(await executor.run(encryptor.finalize))
+        yield encryptor.header()
+        async for block in stream_spool(spool):
+            yield block
+    finally:
+        await file.close()
+
+async def decrypt_upload(file: UploadFile, decryptor):
+    """Decrypt an upload chunk by chunk; used when output needs no end-of-file check."""
+    try:
+        while chunk := await read_chunk(file, decryptor):
+            yield await executor.run(decryptor.update, chunk, size=len(chunk))
+        yield await executor.run(decryptor.finalize)
+    finally:
+        await file.close()
+
+async def decrypt_container_upload(file: UploadFile, reader: ContainerReader):
+    """decrypt_upload for containers, one bounded piece per yield.
 
-def get_db():
-    db = SessionLocal()
+    A compressed segment can inflate to far more than was read, so pieces
+    are pulled from the reader one at a time in the pool.
+    """
     try:
-        yield db
+        while chunk := await read_chunk(file, reader):
+            pieces = reader.pieces(chunk)
+            while (piece := await executor.run(next, pieces, None, size=len(chunk))) is not None:
+                yield piece
+        pieces = reader.pieces(last=True)
+        while (piece := await executor.run(next, pieces, None)) is not None:
+            yield piece
     finally:
-        db.close()
+        await file.close()
+
+async def decrypt_upload_verified(file: UploadFile, decryptor: StreamDecryptor):
+    """Decrypt an AEAD upload into a spool and return it once the tag checks out.
+
+    Nothing is sent to the client before verification, so a forged or
+    corrupted file fails the request instead of truncating a download.
+    """
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        while chunk := await read_chunk(file, decryptor):
+            spool.write(await executor.run(decryptor.update, chunk, size=len(chunk)))
+        spool.write(await executor.run(decryptor.finalize))
+    except Exception:
+        spool.close()
+        raise
+    return spool
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request, "message": "Hello, FastAPI!"})
+    return get_templates().TemplateResponse("index.html", {"request": request, "message": "Hello, FastAPI!"})
 
-@app.post("/encrypt-text")
-async def generate_cipher_text(field: EncryptRequest, db: Session = Depends(get_db)):
-    cipher, key, algorithm, mode = encrypt_text(field.text, field.algorithm, field.mode)
-    db_record = Table(
-        cipher_key=key,
+@router.get("/ready")
+async def ready(request: Request):
+    """Readiness probe: 503 until the startup warmup has finished."""
+    state = request.app.state
+    if getattr(state, "warmup_error", None):
+        return JSONResponse({"status": "failed", "error": state.warmup_error}, status_code=503)
+    if not getattr(state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503, headers={"Retry-After": "1"})
+    return {"status": "ready"}
+
+@router.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.post("/encrypt-text")
+async def generate_cipher_text(field: EncryptRequest):
+    cipher, key, algorithm, mode = await encrypt_async(field.text.encode(), field.algorithm, field.mode)
+    key_id = await keystore.register(key, algorithm, mode) if field.store_key else None
+    await audit_log.record(
+        cipher_key=key_reference(key, key_id),
         algorithm=algorithm,
         mode=mode,
         operation="encryption",
     )
-    db.add(db_record)
-    db.commit()
-    db.refresh(db_record)
-    return {
-        "cipher": cipher,
+    with stage("encode", algorithm, mode):
+        encoded = encode_bytes(cipher, field.encoding)
+    response = {
+        "cipher": encoded,
         "key": key,
     }
+    if key_id:
+        response["key_id"] = key_id
+    return response
 
-@app.post("/encrypt-file")
+@router.post("/encrypt-text/raw")
+async def generate_cipher_raw(request: Request, algorithm: str, mode: str, store_key: bool = False):
+    """Binary variant of /encrypt-text: raw body in, raw ciphertext out, key in a header."""
+    data = await read_body(request, algorithm, mode)
+    try:
+        cipher, key, algorithm, mode = await encrypt_async(data, algorithm, mode)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    key_id = await keystore.register(key, algorithm, mode) if store_key else None
+    await audit_log.record(
+        cipher_key=key_reference(key, key_id),
+        algorithm=algorithm,
+        mode=mode,
+        operation="encryption",
+    )
+    headers = {"key": key}
+    if key_id:
+        headers["key-id"] = key_id
+    return Response(memoryview(cipher), media_type="application/octet-stream", headers=headers)
+
+def encrypt_batch(items: list[EncryptRequest]):
+    """Encrypt every item, collecting per-item results or errors."""
+    results, records = [], []
+    for index, item in enumerate(items):
+        try:
+            cipher, key, algorithm, mode = encrypt_bytes(item.text.encode(), item.algorithm, item.mode)
+        except Exception as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        results.append({"index": index, "cipher": encode_bytes(cipher, item.encoding), "key": key})
+        records.append(dict(cipher_key=key, algorithm=algorithm, mode=mode, operation="encryption"))
+    return results, records
+
+def decrypt_batch(items: list[DecryptRequest]):
+    """Decrypt every item, collecting per-item results or errors."""
+    results, records = [], []
+    for index, item in enumerate(items):
+        try:
+            if not item.key:
+                raise ValueError("Unknown key_id" if item.key_id else "key or key_id is required")
+            raw = decode_text(item.cipher, item.encoding)
+            text = decrypt_bytes(raw, item.key, item.algorithm, item.mode).decode()
+        except Exception as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        results.append({"index": index, "plain-text": text})
+        records.append(dict(cipher_key=key_reference(item.key, item.key_id), algorithm=item.algorithm, mode=item.mode,
+                            operation="decryption"))
+    return results, records
+
+@router.post("/encrypt-text/batch")
+async def generate_cipher_text_batch(field: EncryptBatchRequest):
+    size = sum(len(item.text or "") for item in field.items)
+    results, records = await executor.run(encrypt_batch, field.items, size=size)
+    stored = [
+        (result, record) for result, record in zip((r for r in results if "key" in r), records)
+        if field.items[result["index"]].store_key
+    ]
+    key_ids = await keystore.register_many([(r["key"], rec["algorithm"], rec["mode"]) for r, rec in stored])
+    for (result, record), key_id in zip(stored, key_ids):
+        result["key_id"] = key_id
+        record["cipher_key"] = key_reference(record["cipher_key"], key_id)
+    await audit_log.record_many(records)
+    return {"results": results}
+
+@router.post("/decrypt-text/batch")
+async def generate_plain_text_batch(field: DecryptBatchRequest):
+    size = sum(len(item.cipher) for item in field.items)
+    for index, item in enumerate(field.items):
+        if item.key_id:
+            try:
+                key, algorithm, mode = await keystore.resolve(item.key_id)
+            except KeyError:
+                key, algorithm, mode = None, item.algorithm, item.mode
+            field.items[index] = item.model_copy(update={"key": key, "algorithm": algorithm, "mode": mode})
+    results, records = await executor.run(decrypt_batch, field.items, size=size)
+    await audit_log.record_many(records)
+    return {"results": results}
+
+@router.post("/encrypt-file")
 async def generate_cipher_file(
-    db: Session = Depends(get_db),
     algorithm: str = Form(...),
     file: UploadFile = File(...),
     mode: str = Form(...),
+    container: bool = Form(False),
+    store_key: bool = Form(False),
+    compression: str = Form("none"),
+    compression_level: int | None = Form(None),
 ):
     if not file:
         raise HTTPException(status_code=400, detail="File is required")
 
     try:
-        content = await file.read()
         ext = Path(file.filename).suffix 
         original_name = Path(file.filename).stem  
 
-        cipher_b64, key, used_algorithm, used_mode = encrypt_file(content, algorithm=algorithm, mode=mode)
+        codec = "none"
+        if compression != "none":
+            # Decide from the first bytes, then hand the whole upload to the stream
+            codec = choose_codec(compression, await file.read(COMPRESSION_SAMPLE))
+            await file.seek(0)
+        if container or compression != "none":
+            encryptor = ContainerWriter(algorithm, mode, compression=codec, level=compression_level)
+        else:
+            encryptor = StreamEncryptor(algorithm, mode, length=file.size)
+        key = encryptor.key.hex()
+        key_id = await keystore.register(key, encryptor.algorithm, encryptor.mode) if store_key else None
 
-        db_record = Table(
-            cipher_key=key, 
-            algorithm=used_algorithm, 
-            mode=used_mode, 
+        await audit_log.record(
+            cipher_key=key_reference(key, key_id), 
+            algorithm=encryptor.algorithm, 
+            mode=encryptor.mode, 
             operation="encryption", 
             file_extension=ext
         )
-        db.add(db_record)
-        db.commit()
-        db.refresh(db_record)
 
         disguised_filename = f"{original_name}{ext}.enc"
-        encrypted_bytes = base64.b64decode(cipher_b64)
-        bio = BytesIO(encrypted_bytes)
 
         headers = {
             "Content-Disposition": f'attachment; filename="{disguised_filename}"',
             "key": key,
             "filename": disguised_filename
         }
+        if key_id:
+            headers["key-id"] = key_id
+        if compression != "none":
+            headers["compression"] = codec
 
-        return StreamingResponse(bio, media_type="application/octet-stream", headers=headers,)
+        # The upload is closed by encrypt_upload once the response is sent
+        return StreamingResponse(encrypt_upload(file, encryptor), media_type="application/octet-stream", headers=headers,)
 
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
         await file.close()
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/decrypt-text")
-async def generate_plain_text(field: DecryptRequest, db: Session = Depends(get_db)):
+@router.post("/decrypt-text")
+async def generate_plain_text(field: DecryptRequest):
+    key, algorithm, mode = await resolve_key(field.key, field.key_id, field.algorithm, field.mode)
     try:
-        text = decrypt_text(
-            ciphertext_b64=field.cipher,
-            key_hex=field.key,
-            mode=field.mode,
-            algorithm=field.algorithm
+        with stage("decode", *metric_labels(algorithm, mode)):
+            ciphertext = decode_text(field.cipher, field.encoding)
+        plain = await decrypt_async(
+            ciphertext=ciphertext,
+            key_hex=key,
+            mode=mode,
+            algorithm=algorithm
         )
-        db_record = Table(
-            cipher_key=field.key,
-            algorithm=field.algorithm,
-            mode=field.mode,
+        text = plain.decode()
+        await audit_log.record(
+            cipher_key=key_reference(key, field.key_id),
+            algorithm=algorithm,
+            mode=mode,
             operation="decryption",
         )
-        db.add(db_record)
-        db.commit()
-        db.refresh(db_record)
         return {
             "plain-text": text,
         }
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/decrypt-file")
+@router.post("/decrypt-text/raw")
+async def generate_plain_raw(
+    request: Request,
+    algorithm: str | None = None,
+    mode: str | None = None,
+    key: str | None = Header(None),
+    key_id: str | None = Header(None),
+):
+    """Binary variant of /decrypt-text: raw ciphertext in, raw plaintext out."""
+    key, algorithm, mode = await resolve_key(key, key_id, algorithm, mode)
+    data = await read_body(request, algorithm, mode)
+    try:
+        plain = await decrypt_async(data, key, algorithm, mode)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    await audit_log.record(
+        cipher_key=key_reference(key, key_id),
+        algorithm=algorithm,
+        mode=mode,
+        operation="decryption",
+    )
+    return Response(memoryview(plain), media_type="application/octet-stream")
+
+@router.post("/decrypt-file")
 async def generate_plain_file(
-    db: Session = Depends(get_db),
-    algorithm: str = Form(...),
-    key: str = Form(...),
+    algorithm: str | None = Form(None),
+    key: str | None = Form(None),
     file: UploadFile = File(...),
-    mode: str = Form(...),
+    mode: str | None = Form(None),
+    key_id: str | None = Form(None),
 ):
     if not file:
         raise HTTPException(status_code=400, detail="File is required")
+    key, algorithm, mode = await resolve_key(key, key_id, algorithm, mode)
 
     try:
-        content = await file.read()
         file_path = Path(file.filename)
         ext = file_path.suffix
         original_name = file_path.stem
 
-        decrypted_bytes = decrypt_file(
-            key_hex=key,
-            file_input=content,
-            algorithm=algorithm,
-            mode=mode
-        )
+        with stage("read", *metric_labels(algorithm, mode)):
+            head = await file.read(HEADER_PEEK)
+        if is_container(head):
+            # Self-describing; segments are verified one by one as they stream
+            decryptor = ContainerReader(key, ContainerHeader.parse(head))
+            algorithm, mode = decryptor.algorithm, decryptor.mode
+            await file.seek(decryptor.header_size)
+        elif not algorithm or not mode:
+            raise HTTPException(status_code=400, detail="algorithm and mode are required unless the file is a container")
+        else:
+            decryptor = StreamDecryptor(key, algorithm, mode, length=file.size)
+            await file.seek(0)
+            decryptor.begin(await read_chunk(file, decryptor, decryptor.header_size))
 
-        db_record = Table(
-            cipher_key=key,
+        # Legacy AEAD output is released only after the tag verifies; other modes
+        # stream straight through and a bad final block just ends the download early
+        if decryptor.verify_at_end:
+            spool = await decrypt_upload_verified(file, decryptor)
+            await file.close()
+            body = stream_spool(spool)
+        elif isinstance(decryptor, ContainerReader):
+            body = decrypt_container_upload(file, decryptor)
+        else:
+            body = decrypt_upload(file, decryptor)
+
+        await audit_log.record(
+            cipher_key=key_reference(key, key_id),
             algorithm=algorithm, 
             mode=mode, 
             operation="decryption", 
             file_extension=ext
         )
-        db.add(db_record)
-        db.commit()
-        db.refresh(db_record)
 
         headers = {
             "Content-Disposition": f'attachment; filename="{original_name}"',
             "filename": original_name
         }
 
-        return StreamingResponse(decrypted_bytes, media_type="application/octet-stream", headers=headers)
+        return StreamingResponse(body, media_type="application/octet-stream", headers=headers)
 
+    except HTTPException:
+        await file.close()
+        raise
     except Exception as e:
-        db.rollback()
+        await file.close()
         print("Decryption error traceback:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Decryption failed: {str(e)}")
 
-    finally:
-        await file.close()
 
+def get_job(job_id: str):
+    try:
+        return jobs.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+async def body_chunks(request: Request):
+    """request.stream() that ends quietly if the client drops, so the job keeps what arrived."""
+    try:
+        async for chunk in request.stream():
+            yield chunk
+    except ClientDisconnect:
+        return
+
+@router.post("/jobs", status_code=201)
+async def create_job(field: JobRequest, response: Response):
+    try:
+        job = jobs.create(
+            field.algorithm, field.mode, field.length, filename=field.filename,
+            compression=field.compression, level=field.compression_level, store_key=field.store_key,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["Location"] = f"/jobs/{job.id}"
+    response.headers["Upload-Offset"] = "0"
+    return job.describe()
+
+@router.head("/jobs/{job_id}")
+async def job_offset(job_id: str):
+    job = get_job(job_id)
+    return Response(headers={"Upload-Offset": str(job.offset), "Upload-Length": str(job.length), "Cache-Control": "no-store"})
 
-@app.get("/favicon.ico")
+@router.patch("/jobs/{job_id}")
+async def upload_job_chunk(job_id: str, request: Request, upload_offset: int = Header(...)):
+    """Append the request body at Upload-Offset; encrypts as it arrives."""
+    job = get_job(job_id)
+    try:
+        offset = await jobs.append(job, upload_offset, body_chunks(request))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(job.offset)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e), headers={"Upload-Offset": str(job.offset)})
+    except Exception as e:
+        print("Job upload error traceback:")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if job.status == "done":
+        if job.store_key:
+            job.key_id = await keystore.register(job.key, job.algorithm, job.mode)
+            await jobs.save(job)
+        await audit_log.record(
+            cipher_key=key_reference(job.key, job.key_id),
+            algorithm=job.algorithm,
+            mode=job.mode,
+            operation="encryption",
+            file_extension=Path(job.filename).suffix or None,
+        )
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = get_job(job_id)
+    status = job.describe()
+    if job.status == "done":
+        status["key"] = job.key
+        if job.key_id:
+            status["key_id"] = job.key_id
+    return status
+
+@router.get("/jobs/{job_id}/ciphertext")
+async def job_ciphertext(job_id: str):
+    job = get_job(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    filename = f"{job.filename or job.id}.enc"
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "filename": filename,
+        "key": job.key,
+    }
+    return StreamingResponse(jobs.stream(job), media_type="application/octet-stream", headers=headers)
+
+@router.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    get_job(job_id)
+    try:
+        jobs.delete(job_id)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/audit/operations")
+async def audit_operations(
+    operation: str | None = None,
+    algorithm: str | None = None,
+    mode: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Audit rows newest first; pass next_cursor back as cursor for the following page."""
+    since, until = naive_local(since), naive_local(until)
+    await audit.setup()
+    try:
+        items, next_cursor = await audit_log.storage.run(
+            query_operations, operation, algorithm, mode, since, until, cursor, limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/audit/stats")
+async def audit_stats(
+    operation: str | None = None,
+    algorithm: str | None = None,
+    mode: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """Operation counts per hour, algorithm and mode."""
+    since, until = naive_local(since), naive_local(until)
+    await audit.setup()
+    items = await audit_log.storage.run(query_stats, operation, algorithm, mode, since, until)
+    return {"items": items}
+
+@router.get("/audit/archive")
+async def audit_archive(
+    operation: str | None = None,
+    algorithm: str | None = None,
+    mode: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Rows moved out of the operations table by retention; narrow since/until to page."""
+    since, until = naive_local(since), naive_local(until)
+    items, truncated = await asyncio.to_thread(
+        retention.query_archive, operation=operation, algorithm=algorithm, mode=mode,
+        since=since, until=until, limit=limit,
+    )
+    for item in items:
+        item.pop("cipher_key", None)
+    return {"items": items, "truncated": truncated}
+
+@router.get("/favicon.ico")
 async def favicon():
     return {
         "message": "Yet to configure"
-    }
\ No newline at end of file
+    }
+
+def create_app() -> FastAPI:
+    """Build the app; `uvicorn main:create_app --factory` gets a fresh one per worker."""
+    # routes= reuses the route objects; include_router would rebuild every one
+    app = FastAPI(lifespan=lifespan, routes=router.routes)
+    # Inside CORS, so rejections still carry the CORS headers
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["key", "key-id", "filename", "compression", "Location", "Upload-Offset", "Upload-Length", "Retry-After"]
+    )
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(TextGZipMiddleware)
+    return app
+
+app = create_app()
@@ -0,0 +1,180 @@
+"""In-process counters and histograms in the Prometheus text format.
+
+`stage()` times one step of a request (read, keygen, cipher, encode,
+audit) labelled by algorithm and mode. MetricsMiddleware times whole
+requests and, when PROFILING_ENABLED is set, profiles a single request on
+demand through the X-Profile header (cprofile or tracemalloc).
+"""
+import asyncio
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_metrics = []
+
+
+def _escape(value) -> str:
+    """Label value escaping from the text format: backslash, quote, newline."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name: str, help: str, read):
+        self.name, self.help, self.read = name, help, read
+        _metrics.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, count, total) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _labels(self.labels + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram("hashbytes_stage_seconds", "Time spent in one request stage", ("stage", "algorithm", "mode"))
+BYTES_PROCESSED = Counter("hashbytes_bytes_total", "Bytes passed through a cipher", ("operation", "algorithm", "mode"))
+REQUEST_SECONDS = Histogram("hashbytes_request_seconds", "Request latency including the response body", ("method", "route", "status"))
+
+
+@contextmanager
+def stage(name: str, algorithm: str = "", mode: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, algorithm=algorithm, mode=mode)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and serving X-Profile requests."""
+
+    def __init__(self, app):
+        self.app = app
+        # tracemalloc and the profiler are process wide: one profiled request at a time
+        self._profile_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profile = dict(scope["headers"]).get(b"x-profile", b"").decode().lower() if PROFILING_ENABLED else ""
+        profile_id = uuid.uuid4().hex if profile in ("cprofile", "tracemalloc") else ""
+        start = time.perf_counter()
+        try:
+            if profile_id:
+                async with self._profile_lock:
+                    await self._profiled(profile, profile_id, scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                    route=getattr(route, "path", "unmatched"), status=status)
+
+    async def _profiled(self, kind, profile_id, scope, receive, send):
+        """Run one request under cProfile or tracemalloc and write the report to PROFILE_DIR.
+
+        cProfile only sees the event loop thread, including whatever other
+        requests it served meanwhile; cipher work in the pool is not included.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if kind == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+            return
+
+        tracemalloc.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.txt"), "w") as f:
+                f.write(f"current {current} bytes, peak {peak} bytes\n")
+                for stat in snapshot.statistics("lineno")[:25]:
+                    f.write(f"{stat}\n")
@@ -0,0 +1,230 @@
+"""Audit retention: move old operations rows into compressed archive segments.
+
+Rows past the age limit (AUDIT_RETENTION_DAYS), or past the row limit
+(AUDIT_MAX_ROWS, oldest first), are appended as JSON lines to
+archive/operations-YYYY-MM-DD.jsonl.gz, one file per day of performed_at.
+Every run appends a new gzip member, so existing segment data is never
+rewritten, and gzip readers see the members as one stream.
+
+Rows are moved in small batches: a segment is written and fsynced before
+its rows are deleted, each delete is its own short transaction, and the
+loop pauses between batches so the audit writer is never locked out for
+long. A crash between the two steps archives a batch twice rather than
+losing it. operation_stats is left alone, so hourly counts keep covering
+archived rows. Freed pages are returned with PRAGMA incremental_vacuum.
+
+Every uvicorn worker runs the loop, but a pass first takes an exclusive
+lock on AUDIT_ARCHIVE_DIR/.retention.lock and is skipped while another
+process holds it, so rows are archived once and segments are appended by
+one writer at a time. Hosts sharing one database must share the archive
+directory too, or run retention on a single host.
+
+Run one pass by hand from Backend/:
+
+    python -m retention
+    python -m retention --convert   # one-off switch of an old audit.db to incremental auto_vacuum
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import traceback
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import delete, func, select, text
+
+import audit
+from audit import audit_log
+from definitions import Table
+from locks import try_lock
+from metrics import Counter
+
+# Both 0 by default: nothing leaves the operations table unless asked for
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", 0))
+AUDIT_MAX_ROWS = int(os.environ.get("AUDIT_MAX_ROWS", 0))
+AUDIT_ARCHIVE_DIR = os.environ.get("AUDIT_ARCHIVE_DIR", "archive")
+AUDIT_RETENTION_INTERVAL = float(os.environ.get("AUDIT_RETENTION_INTERVAL", 3600))
+AUDIT_RETENTION_BATCH = int(os.environ.get("AUDIT_RETENTION_BATCH", 1000))
+# Pause between batches so queued audit flushes get the write lock
+BATCH_PAUSE = 0.01
+VACUUM_PAGES = 2000
+
+ROWS_ARCHIVED = Counter("hashbytes_audit_rows_archived", "Audit rows moved from the operations table to archive segments")
+
+COLUMNS = ("id", "cipher_key", "file_extension", "algorithm", "mode", "operation", "performed_at")
+
+
+def segment_path(day: date, archive_dir: str = AUDIT_ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"operations-{day.isoformat()}.jsonl.gz")
+
+
+def segment_days(archive_dir: str = AUDIT_ARCHIVE_DIR) -> list[date]:
+    if not os.path.isdir(archive_dir):
+        return []
+    days = []
+    for name in os.listdir(archive_dir):
+        if name.startswith("operations-") and name.endswith(".jsonl.gz"):
+            try:
+                days.append(date.fromisoformat(name[len("operations-"):-len(".jsonl.gz")]))
+            except ValueError:
+                continue
+    return sorted(days)
+
+
+def write_segments(rows: list[dict], archive_dir: str = AUDIT_ARCHIVE_DIR):
+    """Append rows to their day's segment and fsync it; rows must be sorted by performed_at."""
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, day_rows in groupby(rows, key=lambda row: row["performed_at"].date()):
+        with open(segment_path(day, archive_dir), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for row in day_rows:
+                    f.write(json.dumps({**row, "performed_at": row["performed_at"].isoformat()}).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+@contextmanager
+def lease(archive_dir: str = AUDIT_ARCHIVE_DIR):
+    """Yield True while holding the cross-process retention lock, False if someone else has it."""
+    os.makedirs(archive_dir, exist_ok=True)
+    with try_lock(os.path.join(archive_dir, ".retention.lock")) as held:
+        yield held
+
+
+def _count(db) -> int:
+    return db.scalar(select(func.count(Table.id)))
+
+
+def _next_batch(db, cutoff: datetime | None, excess: int, batch_size: int) -> list[dict]:
+    query = select(*(getattr(Table, column) for column in COLUMNS)).order_by(Table.performed_at, Table.id)
+    if excess > 0:
+        query = query.limit(min(batch_size, excess))
+    elif cutoff is not None:
+        query = query.where(Table.performed_at < cutoff).limit(batch_size)
+    else:
+        return []
+    return [dict(row._mapping) for row in db.execute(query)]
+
+
+def _delete(db, ids: list[int]) -> int:
+    deleted = db.execute(delete(Table).where(Table.id.in_(ids))).rowcount
+    db.commit()
+    return deleted
+
+
+async def archive_expired(max_age_days: int = AUDIT_RETENTION_DAYS, max_rows: int = AUDIT_MAX_ROWS,
+                          archive_dir: str = AUDIT_ARCHIVE_DIR, batch_size: int = AUDIT_RETENTION_BATCH,
+                          store=None) -> int:
+    """Archive and delete rows outside the retention policies; returns the number moved.
+
+    Runs under lease(); returns 0 straight away while another process has it.
+    """
+    store = store or audit_log.storage
+    with lease(archive_dir) as held:
+        if not held:
+            return 0
+        cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days > 0 else None
+        excess = await store.run(_count) - max_rows if max_rows > 0 else 0
+        moved = 0
+        while rows := await store.run(_next_batch, cutoff, excess, batch_size):
+            await asyncio.to_thread(write_segments, rows, archive_dir)
+            # Only the ids just archived are deleted, however the table changed meanwhile
+            deleted = await store.run(_delete, [row["id"] for row in rows])
+            moved += deleted
+            excess -= deleted
+            ROWS_ARCHIVED.inc(deleted)
+            await asyncio.sleep(BATCH_PAUSE)
+        return moved
+
+
+def _incremental_vacuum(db, pages: int) -> bool:
+    if db.get_bind().dialect.name != "sqlite" or db.scalar(text("PRAGMA auto_vacuum")) != 2:
+        return False
+    db.execute(text(f"PRAGMA incremental_vacuum({int(pages)})"))
+    db.commit()
+    return True
+
+
+async def incremental_vacuum(pages: int = VACUUM_PAGES, store=None) -> bool:
+    """Release up to `pages` free pages; False if the database is not SQLite in incremental mode."""
+    return await (store or audit_log.storage).run(_incremental_vacuum, pages)
+
+
+def convert_to_incremental(store=None):
+    """Switch an existing SQLite file to incremental auto_vacuum; rewrites the whole file once."""
+    store = store or audit_log.storage
+    if store.name != "sql" or store.engine.dialect.name != "sqlite":
+        raise ValueError("Only a SQLite database on the sql backend can be converted")
+    with store.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+async def run_once() -> int:
+    await audit.setup()
+    moved = await archive_expired()
+    if moved and not await incremental_vacuum() and audit_log.storage.engine.dialect.name == "sqlite":
+        print("audit.db is not in incremental auto_vacuum mode, run `python -m retention --convert` once to reclaim space")
+    return moved
+
+
+async def run_forever(interval: float = AUDIT_RETENTION_INTERVAL):
+    """Background loop started by the app lifespan."""
+    while True:
+        try:
+            await run_once()
+        except Exception:
+            print("Audit retention pass failed:")
+            traceback.print_exc()
+        await asyncio.sleep(interval)
+
+
+def retention_enabled() -> bool:
+    return AUDIT_RETENTION_DAYS > 0 or AUDIT_MAX_ROWS > 0
+
+
+def query_archive(operation=None, algorithm=None, mode=None, since=None, until=None,
+                  limit: int = 100, archive_dir: str = AUDIT_ARCHIVE_DIR) -> tuple[list[dict], bool]:
+    """Archived rows matching the filters, in archive order, and whether more matched than limit.
+
+    Only the day segments overlapping since/until are opened.
+    """
+    wanted = {"operation": operation, "algorithm": algorithm, "mode": mode}
+    items = []
+    for day in segment_days(archive_dir):
+        if (since and day < since.date()) or (until and day > until.date()):
+            continue
+        with gzip.open(segment_path(day, archive_dir), "rt") as f:
+            for line in f:
+                row = json.loads(line)
+                if any(value and row[name] != value for name, value in wanted.items()):
+                    continue
+                performed_at = datetime.fromisoformat(row["performed_at"])
+                if (since and performed_at < since) or (until and performed_at >= until):
+                    continue
+                if len(items) == limit:
+                    return items, True
+                items.append(row)
+    return items, False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--convert", action="store_true", help="switch audit.db to incremental auto_vacuum (full VACUUM)")
+    args = parser.parse_args()
+    asyncio.run(_main(args))
+
+
+async def _main(args):
+    await audit.setup()
+    if args.convert:
+        convert_to_incremental()
+    print(f"archived {await run_once()} rows")
+    await audit_log.storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Audit storage backends.
+
+Everything that touches the audit database goes through `Storage.run(fn,
+*args)`, where fn takes a sync SQLAlchemy Session. The backend decides where
+that runs:
+
+    sql      any SQLAlchemy URL; fn runs in a worker thread off the event loop
+    async    an async driver URL (sqlite+aiosqlite://, postgresql+asyncpg://),
+             fn runs through AsyncSession.run_sync; the driver is not a
+             requirement of this app and must be installed separately
+    memory   private in-memory SQLite, for benchmarks and local runs
+    null     like memory, but every write is rolled back
+
+Configured with AUDIT_BACKEND, AUDIT_DATABASE_URL and the AUDIT_POOL_* /
+AUDIT_SQLITE_BUSY_TIMEOUT settings below. With several uvicorn workers on
+one SQLite file, the busy timeout lets writers queue on the lock instead of
+failing; beyond that, point AUDIT_DATABASE_URL at a server database.
+"""
+import asyncio
+import os
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+AUDIT_BACKEND = os.environ.get("AUDIT_BACKEND", "sql")
+AUDIT_DATABASE_URL = os.environ.get("AUDIT_DATABASE_URL", "sqlite:///audit.db")
+AUDIT_POOL_SIZE = int(os.environ.get("AUDIT_POOL_SIZE", 5))
+AUDIT_MAX_OVERFLOW = int(os.environ.get("AUDIT_MAX_OVERFLOW", 10))
+AUDIT_POOL_TIMEOUT = float(os.environ.get("AUDIT_POOL_TIMEOUT", 30))
+AUDIT_POOL_RECYCLE = int(os.environ.get("AUDIT_POOL_RECYCLE", 1800))
+AUDIT_SQLITE_BUSY_TIMEOUT = int(os.environ.get("AUDIT_SQLITE_BUSY_TIMEOUT", 5000))
+
+
+def _is_memory(url: str) -> bool:
+    return url.split("?")[0].rstrip("/").endswith((":", ":memory:"))
+
+
+def _engine_options(url: str, **pool) -> dict:
+    if not url.startswith("sqlite"):
+        return dict(pool, pool_pre_ping=True)
+    if _is_memory(url):
+        # One shared connection, or every checkout would see an empty database
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    # The busy timeout is set by the connect listener below
+    return dict(pool, connect_args={"check_same_thread": False})
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run during a flush; NORMAL skips the fsync per commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={AUDIT_SQLITE_BUSY_TIMEOUT}")
+    # Only takes effect for a new file; see retention.convert_to_incremental
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class Storage:
+    """Runs session functions against a SQLAlchemy engine in a worker thread.
+
+    The engine is created on first use, so importing the app opens nothing.
+    """
+
+    name = "sql"
+
+    def __init__(self, url: str = AUDIT_DATABASE_URL, pool_size: int = AUDIT_POOL_SIZE,
+                 max_overflow: int = AUDIT_MAX_OVERFLOW, pool_timeout: float = AUDIT_POOL_TIMEOUT,
+                 pool_recycle: int = AUDIT_POOL_RECYCLE):
+        self.url = url
+        self._options = _engine_options(
+            url, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout, pool_recycle=pool_recycle,
+        )
+        self._engine = None
+        self._session_factory = None
+        self._lock = threading.Lock()
+
+    def _ensure_engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine, self._session_factory = self._connect()
+
+    @property
+    def engine(self):
+        self._ensure_engine()
+        return self._engine
+
+    @property
+    def session_factory(self):
+        self._ensure_engine()
+        return self._session_factory
+
+    def _connect(self):
+        engine = create_engine(self.url, **self._options)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _sqlite_pragmas)
+        return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def _call(self, fn, *args):
+        db = self.session_factory()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    async def run(self, fn, *args):
+        """Call fn(session, *args) off the event loop and return its result."""
+        return await asyncio.to_thread(self._call, fn, *args)
+
+    def run_sync(self, fn, *args):
+        """Blocking run(), for scripts outside the event loop."""
+        return self._call(fn, *args)
+
+    async def setup(self, schema):
+        """Call schema(connection) in a transaction, e.g. metadata.create_all."""
+        await asyncio.to_thread(self._setup, schema)
+
+    def _setup(self, schema):
+        with self.engine.begin() as conn:
+            schema(conn)
+
+    async def close(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self):
+        super().__init__("sqlite://")
+
+
+class NullStorage(MemoryStorage):
+    """Accepts every write and keeps none of it; queries see empty tables."""
+
+    name = "null"
+
+    def _connect(self):
+        engine, session_factory = super()._connect()
+        # pysqlite only opens a transaction before DML, which would let the
+        # savepoints below commit; hand transaction control to SQLAlchemy
+        event.listen(engine, "connect", lambda dbapi_connection, record: setattr(dbapi_connection, "isolation_level", None))
+        event.listen(engine, "begin", lambda conn: conn.exec_driver_sql("BEGIN"))
+        return engine, session_factory
+
+    def _call(self, fn, *args):
+        # Session commits only release a savepoint; the outer rollback drops them
+        with self.engine.connect() as conn:
+            outer = conn.begin()
+            db = Session(bind=conn, join_transaction_mode="create_savepoint")
+            try:
+                return fn(db, *args)
+            finally:
+                db.close()
+                outer.rollback()
+
+
+class AsyncStorage(Storage):
+    """Runs session functions through an async driver on the event loop."""
+
+    name = "async"
+
+    def _connect(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        engine = create_async_engine(self.url, **self._options)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        return engine, async_sessionmaker(engine, autocommit=False, autoflush=False)
+
+    async def run(self, fn, *args):
+        async with self.session_factory() as db:
+            return await db.run_sync(fn, *args)
+
+    def run_sync(self, fn, *args):
+        return asyncio.run(self._run_once(fn, *args))
+
+    async def _run_once(self, fn, *args):
+        # asyncio.run() gets a fresh loop, so don't leave pooled connections on it
+        try:
+            return await self.run(fn, *args)
+        finally:
+            await self.engine.dispose()
+
+    async def setup(self, schema):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(schema)
+
+    async def close(self):
+        if self._engine is not None:
+            await self._engine.dispose()
+
+
+BACKENDS = {"sql": Storage, "async": AsyncStorage, "memory": MemoryStorage, "null": NullStorage}
+
+
+def from_env(backend: str = AUDIT_BACKEND, url: str = AUDIT_DATABASE_URL) -> Storage:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown audit backend: {backend}")
+    if backend in ("memory", "null"):
+        return BACKENDS[backend]()
+    return BACKENDS[backend](url)
@@ -0,0 +1,161 @@
+"""Admission control: 413/429/503 and the in-flight byte accounting."""
+import asyncio
+
+import httpx
+
+from admission import Admission, AdmissionMiddleware
+
+
+class App:
+    """Reads the whole body, then waits on `gate` when the request sends x-hold."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.holding = 0
+
+    async def __call__(self, scope, receive, send):
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("client went away")
+            size += len(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        if (b"x-hold", b"1") in scope["headers"]:
+            self.holding += 1
+            await self.gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": str(size).encode()})
+
+
+def run(test, **options):
+    options.setdefault("limits", {path: 8 for path in ("/encrypt-text", "/encrypt-file", "/jobs")})
+    state = Admission(**options)
+    app = App()
+    transport = httpx.ASGITransport(app=AdmissionMiddleware(app, state, enabled=True))
+
+    async def main():
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await test(client, state, app)
+        assert state.inflight_bytes == 0
+        assert state.inflight_requests == 0
+
+    asyncio.run(main())
+
+
+async def held(client, app, method, path, **kwargs):
+    """Start a request that has read its body and stays in flight until app.gate is set."""
+    holding = app.holding
+    task = asyncio.create_task(client.request(method, path, headers={"x-hold": "1"}, **kwargs))
+    while app.holding == holding:
+        await asyncio.sleep(0.001)
+    return task
+
+
+def test_413_on_declared_length_over_the_cap():
+    async def test(client, state, app):
+        response = await client.post("/encrypt-text", content=b"x" * 200)
+        assert response.status_code == 413
+        assert "Retry-After" not in response.headers
+        assert (await client.post("/encrypt-text", content=b"x" * 100)).status_code == 200
+    run(test, max_upload_bytes=100)
+
+
+def test_413_on_undeclared_body_over_the_cap():
+    async def chunks():
+        for _ in range(5):
+            yield b"x" * 50
+
+    async def test(client, state, app):
+        response = await client.post("/encrypt-text", content=chunks())
+        assert response.status_code == 413
+    run(test, max_upload_bytes=100)
+
+
+def test_streaming_routes_have_no_cap_by_default():
+    async def test(client, state, app):
+        response = await client.post("/encrypt-file", content=b"x" * 500)
+        assert response.status_code == 200 and response.text == "500"
+    run(test, max_upload_bytes=100)
+
+
+def test_streaming_cap_can_be_set_per_route():
+    async def test(client, state, app):
+        assert (await client.post("/encrypt-file", content=b"x" * 500)).status_code == 413
+        assert (await client.patch("/jobs/abc", content=b"x" * 500)).status_code == 200
+    run(test, max_upload_bytes=0, upload_limits={"/encrypt-file": 100})
+
+
+def test_429_over_the_concurrency_limit():
+    async def test(client, state, app):
+        first = await held(client, app, "POST", "/encrypt-text", content=b"a")
+        response = await client.post("/encrypt-text", content=b"b")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "3"
+        # Other endpoints have their own limit
+        assert (await client.post("/encrypt-file", content=b"c")).status_code == 200
+        app.gate.set()
+        assert (await first).status_code == 200
+        assert (await client.post("/encrypt-text", content=b"d")).status_code == 200
+    run(test, limits={"/encrypt-text": 1, "/encrypt-file": 1}, retry_after=3)
+
+
+def test_503_when_the_byte_budget_is_used_up():
+    async def test(client, state, app):
+        first = await held(client, app, "POST", "/encrypt-text", content=b"x" * 80)
+        assert state.inflight_bytes == 80
+        response = await client.post("/encrypt-text", content=b"x" * 50)
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert (await client.post("/encrypt-text", content=b"x" * 20)).status_code == 200
+        app.gate.set()
+        assert (await first).status_code == 200
+        assert (await client.post("/encrypt-text", content=b"x" * 50)).status_code == 200
+    run(test, max_inflight_bytes=100)
+
+
+def test_streaming_uploads_are_not_charged():
+    async def test(client, state, app):
+        upload = await held(client, app, "POST", "/encrypt-file", content=b"x" * 1000)
+        assert state.inflight_bytes == 0
+        # A large file in flight does not starve small requests
+        assert (await client.post("/encrypt-text", content=b"x" * 50)).status_code == 200
+        assert (await client.get("/jobs/abc")).status_code == 200
+        app.gate.set()
+        assert (await upload).status_code == 200
+    run(test, max_inflight_bytes=100)
+
+
+def test_one_body_over_the_budget_is_let_in_alone():
+    async def test(client, state, app):
+        assert (await client.post("/encrypt-text", content=b"x" * 500)).status_code == 200
+        big = await held(client, app, "POST", "/encrypt-text", content=b"x" * 500)
+        assert state.inflight_bytes == 500
+        assert (await client.post("/encrypt-text", content=b"x")).status_code == 503
+        app.gate.set()
+        assert (await big).status_code == 200
+    run(test, max_inflight_bytes=100, max_upload_bytes=0)
+
+
+def test_undeclared_bodies_are_charged_as_they_arrive():
+    async def chunks():
+        yield b"x" * 60
+        yield b"x" * 60
+
+    async def test(client, state, app):
+        first = await held(client, app, "POST", "/encrypt-text", content=chunks())
+        assert state.inflight_bytes == 120
+        assert (await client.post("/encrypt-text", content=b"x")).status_code == 503
+        app.gate.set()
+        await first
+    run(test, max_inflight_bytes=100)
+
+
+def test_unlisted_paths_are_never_limited():
+    async def test(client, state, app):
+        first = await held(client, app, "POST", "/encrypt-text", content=b"x" * 80)
+        assert (await client.post("/metrics", content=b"x" * 500)).status_code == 200
+        app.gate.set()
+        await first
+    run(test, limits={"/encrypt-text": 1}, max_inflight_bytes=10, max_upload_bytes=100)
@@ -0,0 +1,77 @@
+"""Hourly counters: upserts that survive concurrent writers."""
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import audit
+from definitions import BASE, HourlyStats, Table
+
+HOUR = datetime(2025, 6, 1, 12)
+
+
+def rows(count: int, operation: str = "encryption", minute: int = 0) -> list[dict]:
+    return [dict(cipher_key="k", algorithm="AES", mode="GCM", operation=operation,
+                 performed_at=HOUR.replace(minute=minute)) for _ in range(count)]
+
+
+def session(url: str = "sqlite://") -> Session:
+    engine = create_engine(url)
+    BASE.metadata.create_all(engine)
+    return Session(engine)
+
+
+def counts(db) -> dict:
+    return {(row.operation, row.hour): row.count for row in db.scalars(select(HourlyStats))}
+
+
+def test_upsert_adds_to_existing_hour():
+    db = session()
+    audit._flush(db, rows(3))
+    audit._flush(db, rows(2, minute=30) + rows(4, operation="decryption"))
+    assert counts(db) == {("encryption", HOUR): 5, ("decryption", HOUR): 4}
+    assert db.query(Table).count() == 9
+
+
+def test_update_then_insert_fallback(monkeypatch):
+    monkeypatch.setattr(audit, "UPSERT_DIALECTS", ())
+    db = session()
+    audit._flush(db, rows(3))
+    audit._flush(db, rows(2))
+    assert counts(db) == {("encryption", HOUR): 5}
+
+
+def test_fallback_retries_when_another_worker_inserted_first(monkeypatch):
+    monkeypatch.setattr(audit, "UPSERT_DIALECTS", ())
+    db = session()
+    real_bump = audit._bump
+    raced = []
+
+    def bump(db_, *key):
+        updated = real_bump(db_, *key)
+        if not updated and not raced:
+            # Another worker's row for the same hour lands between our update and insert
+            raced.append(True)
+            db_.execute(HourlyStats.__table__.insert().values(
+                hour=key[0], operation=key[1], algorithm=key[2], mode=key[3], count=7))
+        return updated
+
+    monkeypatch.setattr(audit, "_bump", bump)
+    audit._flush(db, rows(3))
+    assert raced
+    assert counts(db) == {("encryption", HOUR): 10}
+
+
+def test_rows_are_kept_when_stats_fail(monkeypatch):
+    db = session()
+    audit._flush(db, rows(1))
+
+    def conflicting(db_, rows_):
+        # Stands in for the unique violation of a racing plain INSERT
+        db_.execute(HourlyStats.__table__.insert().values(
+            hour=HOUR, operation="encryption", algorithm="AES", mode="GCM", count=1))
+
+    monkeypatch.setattr(audit, "add_stats", conflicting)
+    audit._flush(db, rows(2))
+    assert db.query(Table).count() == 3
+    assert counts(db) == {("encryption", HOUR): 1}
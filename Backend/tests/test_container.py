@@ -0,0 +1,154 @@
+"""Container format: round trips, tampering, truncation and byte ranges."""
+import io
+import os
+
+import pytest
+
+from compression import DECOMPRESS_PIECE_SIZE, zstandard
+from container import (
+    MODE_IDS, ContainerHeader, ContainerReader, ContainerWriter, decrypt_container, decrypt_range,
+    encrypt_container, is_container, segment_span,
+)
+from logic import TAG_SIZE, compatible_map
+
+SEGMENT = 1024
+# Every AEAD pair the container can name
+PAIRS = [(algorithm, mode) for algorithm, modes in compatible_map.items() for mode in modes if mode in MODE_IDS]
+
+
+def seal(data: bytes, algorithm="AES", mode="GCM", **kwargs):
+    blob, key, _, _ = encrypt_container(data, algorithm, mode, segment_size=SEGMENT, **kwargs)
+    return blob, key
+
+
+def stream(blob: bytes, key: str, chunk: int = 700) -> bytes:
+    """Decrypt through ContainerReader in uneven chunks, as /decrypt-file does."""
+    header = ContainerHeader.parse(blob)
+    reader = ContainerReader(key, header)
+    body = blob[header.size:]
+    out = b"".join(reader.update(body[offset:offset + chunk]) for offset in range(0, len(body), chunk))
+    return out + reader.finalize()
+
+
+@pytest.mark.parametrize("algorithm,mode", PAIRS)
+@pytest.mark.parametrize("size", [0, 1, SEGMENT - 1, SEGMENT, 3 * SEGMENT, 3 * SEGMENT + 17])
+def test_round_trip(algorithm, mode, size):
+    data = os.urandom(size)
+    blob, key = seal(data, algorithm, mode)
+    assert is_container(blob)
+    assert decrypt_container(blob, key) == data
+    assert stream(blob, key) == data
+
+
+def test_round_trip_streamed_writer():
+    data = os.urandom(5 * SEGMENT + 3)
+    writer = ContainerWriter("AES", "GCM", SEGMENT)
+    blob = writer.header() + b"".join(writer.update(data[i:i + 333]) for i in range(0, len(data), 333)) + writer.finalize()
+    assert decrypt_container(blob, writer.key.hex()) == data
+
+
+@pytest.mark.parametrize("codec", ["zlib", pytest.param("zstd", marks=pytest.mark.skipif(
+    zstandard is None, reason="zstandard is not installed"))])
+def test_round_trip_compressed(codec):
+    data = b"hash bytes " * 5000
+    blob, key = seal(data, compression=codec)
+    assert ContainerHeader.parse(blob).compression == codec
+    assert len(blob) < len(data)
+    assert decrypt_container(blob, key) == data
+    assert stream(blob, key) == data
+
+
+def test_compressed_output_comes_in_bounded_pieces():
+    data = bytes(3 * DECOMPRESS_PIECE_SIZE)
+    blob, key = seal(data, compression="zlib")
+    header = ContainerHeader.parse(blob)
+    pieces = list(ContainerReader(key, header).pieces(blob[header.size:], last=True))
+    assert max(map(len, pieces)) <= DECOMPRESS_PIECE_SIZE
+    assert b"".join(pieces) == data
+
+
+def test_wrong_key_fails():
+    blob, _ = seal(b"secret" * 100)
+    with pytest.raises(ValueError):
+        decrypt_container(blob, os.urandom(32).hex())
+
+
+@pytest.mark.parametrize("where", ["first", "middle", "tag"])
+def test_tampered_segment_fails(where):
+    blob, key = seal(os.urandom(3 * SEGMENT + 10))
+    header = ContainerHeader.parse(blob)
+    start, end = segment_span(header, 1, len(blob))
+    offset = {"first": header.size, "middle": start + 5, "tag": end - 1}[where]
+    tampered = bytearray(blob)
+    tampered[offset] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_container(bytes(tampered), key)
+    with pytest.raises(ValueError):
+        stream(bytes(tampered), key)
+
+
+def test_tampered_header_fails():
+    blob, key = seal(os.urandom(2 * SEGMENT))
+    tampered = bytearray(blob)
+    # Last byte of the nonce prefix: still parses, but it is associated data of every segment
+    tampered[ContainerHeader.parse(blob).size - 1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_container(bytes(tampered), key)
+
+
+@pytest.mark.parametrize("dropped", [1, 2])
+def test_truncated_at_segment_boundary_fails(dropped):
+    blob, key = seal(os.urandom(4 * SEGMENT + 100))
+    header = ContainerHeader.parse(blob)
+    start, _ = segment_span(header, 5 - dropped, len(blob))
+    truncated = blob[:start]
+    # Every remaining segment is intact; only the missing last flag gives it away
+    assert (len(truncated) - header.size) % (SEGMENT + TAG_SIZE) == 0
+    with pytest.raises(ValueError):
+        decrypt_container(truncated, key)
+    with pytest.raises(ValueError):
+        stream(truncated, key)
+
+
+def test_truncated_mid_segment_fails():
+    blob, key = seal(os.urandom(2 * SEGMENT + 100))
+    with pytest.raises(ValueError):
+        decrypt_container(blob[:-50], key)
+
+
+def test_reordered_segments_fail():
+    blob, key = seal(os.urandom(3 * SEGMENT + 10))
+    header = ContainerHeader.parse(blob)
+    first = slice(*segment_span(header, 0, len(blob)))
+    second = slice(*segment_span(header, 1, len(blob)))
+    swapped = blob[:header.size] + blob[second] + blob[first] + blob[second.stop:]
+    with pytest.raises(ValueError):
+        decrypt_container(swapped, key)
+
+
+@pytest.mark.parametrize("start,end", [
+    (0, 1), (0, SEGMENT), (SEGMENT - 1, SEGMENT + 1), (10, 3 * SEGMENT - 10),
+    (2 * SEGMENT, 2 * SEGMENT), (3 * SEGMENT, 3 * SEGMENT + 77), (100, 10 * SEGMENT), (5000, 6000),
+])
+def test_decrypt_range(start, end):
+    data = os.urandom(3 * SEGMENT + 77)
+    blob, key = seal(data)
+    assert decrypt_range(io.BytesIO(blob), key, start, end) == data[start:end]
+
+
+def test_decrypt_range_only_opens_covering_segments():
+    data = os.urandom(4 * SEGMENT)
+    blob, key = seal(data)
+    header = ContainerHeader.parse(blob)
+    tampered = bytearray(blob)
+    tampered[segment_span(header, 0, len(blob))[0]] ^= 1
+    # Segment 0 is corrupt, but a range inside segment 2 never touches it
+    assert decrypt_range(io.BytesIO(bytes(tampered)), key, 2 * SEGMENT + 5, 2 * SEGMENT + 50) == data[2 * SEGMENT + 5:2 * SEGMENT + 50]
+    with pytest.raises(ValueError):
+        decrypt_range(io.BytesIO(bytes(tampered)), key, 0, 10)
+
+
+def test_decrypt_range_refuses_compressed():
+    blob, key = seal(b"a" * 10000, compression="zlib")
+    with pytest.raises(ValueError):
+        decrypt_range(io.BytesIO(blob), key, 0, 10)
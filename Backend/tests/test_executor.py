@@ -0,0 +1,62 @@
+"""Split plans on a multi-thread pool match encrypt_bytes and decrypt_bytes byte for byte."""
+import os
+
+import pytest
+
+import executor
+import logic
+from executor import run_parallel, split_decrypt, split_encrypt
+from logic import decrypt_bytes, encrypt_bytes, get_spec
+
+SIZES = [0, 1, 7, 15, 16, 17, 4095, 65536, 100003]
+PAIRS = [("AES", "CTR"), ("AES", "ECB"), ("AES", "CBC"), ("DES3", "CBC"), ("CAST-128", "ECB")]
+
+
+@pytest.fixture(autouse=True)
+def pool():
+    workers = executor.CRYPTO_WORKERS
+    executor.configure(4)
+    yield
+    executor.configure(workers)
+
+
+@pytest.fixture
+def fixed_key(monkeypatch):
+    """Same key and nonce for both paths, so their ciphertexts can be compared."""
+    def key_and_nonce(key_size, nonce_size):
+        return bytes(range(1, key_size + 1)), bytes(range(100, 100 + nonce_size))
+
+    monkeypatch.setattr(logic, "key_and_nonce", key_and_nonce)
+    monkeypatch.setattr(executor, "key_and_nonce", key_and_nonce)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("algorithm,mode", PAIRS)
+def test_split_encrypt_matches_encrypt_bytes(fixed_key, algorithm, mode, size):
+    data = os.urandom(size)
+    plan = split_encrypt(data, algorithm, mode)
+    if mode == "CBC":
+        # Each CBC block needs the previous ciphertext block: sequential only
+        assert plan is None
+        return
+    assert len(plan[0]) > 1 or size < 4 * get_spec(algorithm, mode).block_size
+    ciphertext, key, _, _ = run_parallel(plan)
+    expected, expected_key, _, _ = encrypt_bytes(data, algorithm, mode)
+    assert key == expected_key
+    assert bytes(ciphertext) == bytes(expected)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("algorithm,mode", PAIRS)
+def test_split_decrypt_matches_decrypt_bytes(algorithm, mode, size):
+    data = os.urandom(size)
+    ciphertext, key, _, _ = encrypt_bytes(data, algorithm, mode)
+    plaintext = run_parallel(split_decrypt(ciphertext, key, algorithm, mode))
+    assert bytes(plaintext) == bytes(decrypt_bytes(ciphertext, key, algorithm, mode)) == data
+
+
+@pytest.mark.parametrize("mode", ["ECB", "CBC"])
+def test_split_decrypt_rejects_unaligned_ciphertext(mode):
+    ciphertext, key, _, _ = encrypt_bytes(os.urandom(1000), "AES", mode)
+    with pytest.raises(ValueError):
+        split_decrypt(ciphertext[:-1], key, "AES", mode)
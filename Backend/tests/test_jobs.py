@@ -0,0 +1,117 @@
+"""Upload jobs: offsets, limits, cleanup, and resuming from disk in another process."""
+import asyncio
+import os
+import time
+
+import pytest
+
+import jobs
+from compression import zstandard
+from container import decrypt_container
+from jobs import Job, JobConflict, JobManager
+from keystore import keystore
+from locks import try_lock
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(keystore, "_master", bytes(range(32)))
+    return tmp_path
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def upload(manager, job, offset, *parts) -> int:
+    return asyncio.run(manager.append(job, offset, chunks(*parts)))
+
+
+def ciphertext(job) -> bytes:
+    with open(job.header_path, "rb") as header, open(job.body_path, "rb") as body:
+        return header.read() + body.read()
+
+
+def test_wrong_offset_and_concurrent_upload_conflict():
+    manager = JobManager()
+    job = manager.create("AES", "GCM", 10)
+    with pytest.raises(JobConflict):
+        upload(manager, job, 5, b"x")
+    with try_lock(os.path.join(job.directory, "lock")):
+        with pytest.raises(JobConflict):
+            upload(manager, job, 0, b"x")
+    assert upload(manager, job, 0, b"x" * 10) == 10
+    with pytest.raises(JobConflict):
+        upload(manager, job, 10, b"x")
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", pytest.param("zstd", marks=pytest.mark.skipif(
+    zstandard is None, reason="zstandard is not installed"))])
+def test_resume_in_a_new_process(compression):
+    plaintext = b"resumable,csv,row\n" * 20000 + os.urandom(70000)
+    job = JobManager().create("AES", "GCM", len(plaintext), compression=compression)
+    assert upload(JobManager(), job, 0, plaintext[:100000], plaintext[100000:150001]) == 150001
+
+    # Nothing in memory carries over: the next request sees only JOBS_DIR
+    manager = JobManager()
+    resumed = manager.get(job.id)
+    assert resumed.offset == 150001 and resumed.key == job.key
+    assert upload(manager, resumed, 150001, plaintext[150001:]) == len(plaintext)
+    done = manager.get(job.id)
+    assert done.status == "done" and done.compression == compression
+    assert decrypt_container(ciphertext(done), done.key) == plaintext
+
+
+def test_ciphertext_from_a_request_that_died_is_dropped():
+    manager = JobManager()
+    job = manager.create("ChaCha20", "ChaCha20_Poly1305", 200000)
+    upload(manager, job, 0, b"a" * 100000)
+    with open(job.body_path, "ab") as f:
+        f.write(b"written but never saved")
+    upload(manager, manager.get(job.id), 100000, b"b" * 100000)
+    assert decrypt_container(ciphertext(manager.get(job.id)), job.key) == b"a" * 100000 + b"b" * 100000
+
+
+def test_exceeding_the_declared_length_keeps_earlier_chunks():
+    manager = JobManager()
+    job = manager.create("AES", "EAX", 10)
+    with pytest.raises(ValueError):
+        upload(manager, job, 0, b"12345", b"678901")
+    job = manager.get(job.id)
+    assert job.offset == 5 and job.status == "uploading"
+    upload(manager, job, 5, b"67890")
+    assert decrypt_container(ciphertext(manager.get(job.id)), job.key) == b"1234567890"
+
+
+def test_siv_is_written_segment_by_segment():
+    manager = JobManager()
+    job = manager.create("AES", "SIV", 1000000)
+    upload(manager, job, 0, os.urandom(500000))
+    assert os.path.getsize(job.body_path) > 400000
+
+
+def test_non_aead_modes_are_rejected():
+    with pytest.raises(ValueError):
+        JobManager().create("AES", "CBC", 10)
+
+
+def test_cleanup_removes_idle_jobs_only(jobs_dir):
+    manager = JobManager()
+    idle, recent, busy = (manager.create("AES", "GCM", 10) for _ in range(3))
+    stray = jobs_dir / "not-a-job"
+    stray.mkdir()
+    past = time.time() - 7200
+    open(os.path.join(busy.directory, "lock"), "w").close()
+    for job in (idle, busy):
+        for name in os.listdir(job.directory):
+            os.utime(os.path.join(job.directory, name), (past, past))
+        os.utime(job.directory, (past, past))
+    with try_lock(os.path.join(busy.directory, "lock")):
+        assert manager.cleanup(ttl=3600) == 1
+    assert sorted(os.listdir(jobs_dir)) == sorted([recent.id, busy.id, "not-a-job"])
+    with pytest.raises(KeyError):
+        manager.get(idle.id)
+    with pytest.raises(KeyError):
+        Job.load("../etc")
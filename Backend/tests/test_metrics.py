@@ -0,0 +1,49 @@
+"""Container and split paths count their bytes and time the cipher stage like encrypt_bytes does."""
+import os
+
+import executor
+from container import ContainerHeader, ContainerReader, ContainerWriter, decrypt_container, encrypt_container
+from metrics import BYTES_PROCESSED, STAGE_SECONDS
+
+
+def counted(operation, algorithm, mode) -> float:
+    return BYTES_PROCESSED._values.get((operation, algorithm, mode), 0)
+
+
+def timed(algorithm, mode) -> int:
+    series = STAGE_SECONDS._series.get(("cipher", algorithm, mode))
+    return series[1] if series else 0
+
+
+def test_container_writer_and_reader():
+    data = os.urandom(200000)
+    before, stages = counted("encryption", "AES", "EAX"), timed("AES", "EAX")
+    writer = ContainerWriter("AES", "EAX")
+    blob = writer.header() + writer.update(data) + writer.finalize()
+    assert counted("encryption", "AES", "EAX") - before == len(data)
+    assert timed("AES", "EAX") > stages
+
+    before, stages = counted("decryption", "AES", "EAX"), timed("AES", "EAX")
+    header = ContainerHeader.parse(blob)
+    reader = ContainerReader(writer.key.hex(), header)
+    assert b"".join(reader.pieces(blob[header.size:], last=True)) == data
+    assert counted("decryption", "AES", "EAX") - before == len(blob) - header.size
+    assert timed("AES", "EAX") > stages
+
+
+def test_split_plans():
+    data = os.urandom(300001)
+    before, stages = counted("encryption", "AES", "CTR"), timed("AES", "CTR")
+    ciphertext, key, _, _ = executor.run_parallel(executor.split_encrypt(data, "AES", "CTR"))
+    assert counted("encryption", "AES", "CTR") - before == len(data)
+    assert timed("AES", "CTR") == stages + 1
+
+    before = counted("decryption", "AES", "CTR")
+    assert executor.run_parallel(executor.split_decrypt(ciphertext, key, "AES", "CTR")) == data
+    assert counted("decryption", "AES", "CTR") - before == len(ciphertext)
+
+    before = counted("decryption", "AES", "OCB")
+    blob, key, _, _ = encrypt_container(data, "AES", "OCB")
+    assert executor.run_parallel(executor.split_container_decrypt(blob, key)) == data
+    assert decrypt_container(blob, key) == data
+    assert counted("decryption", "AES", "OCB") - before == 2 * len(blob)
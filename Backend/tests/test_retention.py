@@ -0,0 +1,83 @@
+"""Retention passes: one at a time across processes, every row archived once."""
+import asyncio
+import gzip
+import json
+import multiprocessing
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+import audit
+import retention
+from definitions import Table
+from storage import Storage
+
+
+def make_store(tmp_path, count: int) -> Storage:
+    store = Storage(f"sqlite:///{tmp_path / 'audit.db'}")
+    start = datetime(2025, 6, 1)
+    rows = [dict(cipher_key="k", algorithm="AES", mode="GCM", operation="encryption",
+                 performed_at=start + timedelta(minutes=index)) for index in range(count)]
+
+    async def fill():
+        await audit.setup(store)
+        await store.run(lambda db: (db.execute(insert(Table), rows), db.commit()))
+
+    asyncio.run(fill())
+    return store
+
+
+def archived_ids(archive_dir) -> list[int]:
+    ids = []
+    for day in retention.segment_days(str(archive_dir)):
+        with gzip.open(retention.segment_path(day, str(archive_dir)), "rt") as f:
+            ids += [json.loads(line)["id"] for line in f]
+    return ids
+
+
+def remaining(store) -> int:
+    return store.run_sync(lambda db: db.scalar(select(func.count(Table.id))))
+
+
+def _pass(url, archive_dir, max_rows, start, results):
+    start.wait()
+    store = Storage(url)
+    results.put(asyncio.run(retention.archive_expired(
+        max_age_days=0, max_rows=max_rows, archive_dir=archive_dir, batch_size=50, store=store)))
+
+
+def test_archive_by_row_limit(tmp_path):
+    store = make_store(tmp_path, 300)
+    moved = asyncio.run(retention.archive_expired(max_age_days=0, max_rows=100, archive_dir=str(tmp_path / "archive"),
+                                                  batch_size=40, store=store))
+    assert moved == 200
+    assert remaining(store) == 100
+    assert sorted(archived_ids(tmp_path / "archive")) == list(range(1, 201))
+
+
+def test_pass_is_skipped_while_another_holds_the_lease(tmp_path):
+    store = make_store(tmp_path, 10)
+    archive_dir = str(tmp_path / "archive")
+    with retention.lease(archive_dir) as held:
+        assert held
+        assert asyncio.run(retention.archive_expired(max_age_days=0, max_rows=5, archive_dir=archive_dir, store=store)) == 0
+    assert asyncio.run(retention.archive_expired(max_age_days=0, max_rows=5, archive_dir=archive_dir, store=store)) == 5
+
+
+def test_concurrent_processes_archive_each_row_once(tmp_path):
+    store = make_store(tmp_path, 1000)
+    archive_dir = str(tmp_path / "archive")
+    context = multiprocessing.get_context("fork")
+    start, results = context.Event(), context.Queue()
+    workers = [context.Process(target=_pass, args=(store.url, archive_dir, 500, start, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join(30)
+    moved = sorted(results.get(timeout=5) for _ in workers)
+    # Whoever got the lease moved the excess; the others either waited it out or found nothing left
+    assert sum(moved) == 500
+    ids = archived_ids(archive_dir)
+    assert len(ids) == len(set(ids)) == 500
+    assert remaining(store) == 500
@@ -0,0 +1,99 @@
+"""StreamEncryptor/StreamDecryptor against the one-shot functions, and /decrypt-file on a tampered AEAD upload."""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import logic
+import main
+from logic import REGISTRY, TAG_SIZE, StreamDecryptor, StreamEncryptor, decrypt_bytes, encrypt_bytes, get_spec
+
+PAIRS = sorted((spec.algorithm, spec.mode) for spec in REGISTRY.values())
+# Uneven on purpose: partial blocks, single bytes and chunks spanning many blocks
+CHUNKS = [1, 7, 16, 4095, 3, 65537, 9, 20000]
+
+
+@pytest.fixture
+def fixed_key(monkeypatch):
+    """Same key and nonce for the streamed and the one-shot path."""
+    def key_and_nonce(key_size, nonce_size):
+        return bytes(range(1, key_size + 1)), bytes(range(100, 100 + nonce_size))
+
+    monkeypatch.setattr(logic, "key_and_nonce", key_and_nonce)
+
+
+def pieces(data: bytes):
+    offset, index = 0, 0
+    while offset < len(data):
+        size = CHUNKS[index % len(CHUNKS)]
+        yield data[offset:offset + size]
+        offset, index = offset + size, index + 1
+
+
+def stream_encrypt(data: bytes, algorithm: str, mode: str, length: int | None = None) -> tuple[bytes, str]:
+    encryptor = StreamEncryptor(algorithm, mode, length=length)
+    body = b"".join(encryptor.update(piece) for piece in pieces(data)) + encryptor.finalize()
+    return encryptor.header() + body, encryptor.key.hex()
+
+
+def stream_decrypt(ciphertext: bytes, key: str, algorithm: str, mode: str) -> bytes:
+    decryptor = StreamDecryptor(key, algorithm, mode, length=len(ciphertext))
+    decryptor.begin(ciphertext[:decryptor.header_size])
+    body = ciphertext[decryptor.header_size:]
+    return b"".join(decryptor.update(piece) for piece in pieces(body)) + decryptor.finalize()
+
+
+@pytest.mark.parametrize("size", [0, 15, 100003])
+@pytest.mark.parametrize("algorithm,mode", PAIRS)
+def test_stream_matches_one_shot(fixed_key, algorithm, mode, size):
+    data = os.urandom(size)
+    expected, key, _, _ = encrypt_bytes(data, algorithm, mode)
+    ciphertext, stream_key = stream_encrypt(data, algorithm, mode, length=size)
+    assert stream_key == key
+    assert ciphertext == bytes(expected)
+    assert stream_decrypt(ciphertext, key, algorithm, mode) == data
+    assert bytes(decrypt_bytes(ciphertext, key, algorithm, mode)) == data
+
+
+def test_ccm_with_msg_len_takes_several_chunks():
+    data = os.urandom(50000)
+    encryptor = StreamEncryptor("AES", "CCM", length=len(data))
+    # Without msg_len pycryptodome's CCM refuses a second encrypt() call
+    body = b"".join(encryptor.update(data[offset:offset + 20000]) for offset in range(0, len(data), 20000))
+    assert len(body) == len(data)
+    body += encryptor.finalize()
+    ciphertext = encryptor.header() + body
+    key = encryptor.key.hex()
+    assert stream_decrypt(ciphertext, key, "AES", "CCM") == data
+    assert bytes(decrypt_bytes(ciphertext, key, "AES", "CCM")) == data
+    with pytest.raises(TypeError):
+        unsized = StreamEncryptor("AES", "CCM")
+        unsized.update(data[:20000])
+        unsized.update(data[20000:])
+
+
+def test_siv_puts_the_tag_first(fixed_key):
+    data = os.urandom(3000)
+    ciphertext, key = stream_encrypt(data, "AES", "SIV")
+    spec = get_spec("AES", "SIV")
+    tag, nonce = ciphertext[:TAG_SIZE], ciphertext[TAG_SIZE:spec.header_size]
+    assert spec.split_header(ciphertext) == (nonce, tag)
+    assert nonce == bytes(range(100, 100 + spec.nonce_size))
+    cipher = spec.new(bytes.fromhex(key), nonce)
+    assert cipher.decrypt_and_verify(ciphertext[spec.header_size:], tag) == data
+
+
+@pytest.mark.parametrize("mode", ["GCM", "EAX", "SIV"])
+def test_tampered_legacy_aead_upload_sends_no_plaintext(mode):
+    data = b"attack at dawn, " * 20000
+    ciphertext, key, algorithm, mode = encrypt_bytes(data, "AES", mode)
+    tampered = bytearray(ciphertext)
+    tampered[-1] ^= 1
+    response = TestClient(main.app).post(
+        "/decrypt-file",
+        data={"key": key, "algorithm": algorithm, "mode": mode},
+        files={"file": ("plan.txt.enc", bytes(tampered))},
+    )
+    assert response.status_code == 500
+    assert "MAC check failed" in response.json()["detail"]
+    assert b"attack at dawn" not in response.content